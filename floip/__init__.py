@@ -3,14 +3,24 @@
 FLOIP utility functions.
 """
 import codecs
+import copy
+import hashlib
 import json
+import os
 import re
+import tempfile
 import uuid
+from xml.dom import minidom
 
 import six
 from datapackage import Package
 from pyxform import Survey, constants
-from pyxform.builder import create_survey_element_from_dict
+from pyxform.builder import (SurveyElementBuilder,
+                             create_survey_element_from_dict)
+from pyxform.odk_validate import check_xform
+from pyxform.question_type_dictionary import QUESTION_TYPE_DICT
+
+from floip.memory import profile_phase
 
 try:
     from json.decoder import JSONDecodeError  # pylint: disable=C0412
@@ -53,8 +63,38 @@ FLOIP_QUESTION_TYPES = {
     'video': 'video'
 }
 
+
+def _question_class(question_type):
+    control = QUESTION_TYPE_DICT[question_type].get('control', {})
+    return SurveyElementBuilder.QUESTION_CLASSES[control.get('tag', '')]
+
+
+# pyxform question class of each FLOIP question type, looked up once instead of
+# pyxform deep copying its question type dictionary for every question.
+QUESTION_CLASSES = {
+    floip_type: _question_class(question_type)
+    for floip_type, question_type in QUESTION_TYPES.items()
+}
+
 FLOW_RESULTS_PROFILE = 'flow-results-package'
 
+FLOIP_SELECT_TYPES = ('select_one', 'select_many')
+
+RANGE_REGEX = re.compile(r'\d+')
+
+# pyxform's pretty printing of XForm XML without whitespace around text.
+PRETTY_TEXT_REGEX = re.compile(r'(>)\n\s*(\s[^<>\s].*?)\n\s*(\s</)',
+                               re.DOTALL)
+PRETTY_OUTPUT_REGEX = re.compile(r'\n.*(<output.*>)\n(  )*')
+EMPTY_LABEL_REGEX = re.compile(r'<label>\s*\n*\s*\n*\s*</label>')
+
+ITEXT_REF_REGEX = re.compile(r"jr:itext\(\s*'([^']*)'\s*\)")
+
+DEFAULT_LANGUAGE = 'eng'
+
+# Columns of the session fields of a Flow Results row in wide records.
+SESSION_COLUMNS = ('session_id', 'contact_id', 'timestamp')
+
 
 class ValidationError(Exception):
     """
@@ -78,9 +118,9 @@ def floip_dict_from_xform_dict(question_dict):
         is_range = len(constraint.split('and'))
         if is_range:
             type_options['range'] = [
-                v for v in map(int, re.findall(r'\d+', constraint))
+                v for v in map(int, RANGE_REGEX.findall(constraint))
             ]
-    if question_type in ['select_one', 'select_many']:
+    if question_type in FLOIP_SELECT_TYPES:
         if question_dict['children']:
             type_options['choices'] = [
                 choice['name'] for choice in question_dict['children']
@@ -108,16 +148,36 @@ def survey_questions(questions):
                 yield '/'.join([question['name'], _key]), _value
 
 
-def survey_to_floip_package(survey, flow_id, created, modified, data=None):
+def survey_to_floip_descriptor(survey, flow_id, created, modified,
+                               data=None, questions=None, compression=None,
+                               language=None):
     """
     Takes an XForm suvey object and generates the equivalent Floip Descriptor
-    file.
+    dictionary without building a ``datapackage.Package``.
+
+    questions   - optional iterable of (name, floip question) pairs used
+                  instead of converting ``survey['children']``.
+    compression - optional ``compression`` of the data resource, one of
+                  ``gzip``, ``zstd`` or ``lz4``.
+    language    - the schema ``language``, defaults to the survey's
+                  ``default_language`` or ``eng``. Labels of multi-language
+                  surveys are objects of label per language.
     """
+    # The descriptor fields are keyword options of the public API.
+    # pylint: disable=too-many-arguments
     flow_id = uuid.UUID(flow_id)
 
     if flow_id.version != 4:
         raise ValidationError('Flow ID must be a version 4 UUID')
 
+    if questions is None:
+        questions = survey_questions(survey['children'])
+    if language is None:
+        language = survey.get('default_language')
+        # pyxform's default_language when the form has no languages.
+        if language in (None, 'default'):
+            language = DEFAULT_LANGUAGE
+
     descriptor = {
         # 'profile': 'flow-results-package',
         'profile': 'data-package',
@@ -133,7 +193,7 @@ def survey_to_floip_package(survey, flow_id, created, modified, data=None):
             "mediatype": "application/json",
             "encoding": "utf-8",
             "schema": {
-                "language": "eng",
+                "language": language,
                 "fields": [{
                     "name": "timestamp",
                     "title": "Timestamp",
@@ -164,14 +224,29 @@ def survey_to_floip_package(survey, flow_id, created, modified, data=None):
                     "type": "object"
                 }],
                 "questions": {
-                    name: question
-                    for name, question in survey_questions(survey['children'])
+                    name: question for name, question in questions
                 }
             }
         }]
     }  # yapf: disable
+    if compression:
+        descriptor['resources'][0]['compression'] = compression
+
+    return descriptor
 
-    return Package(descriptor)
+
+def survey_to_floip_package(survey, flow_id, created, modified, data=None,
+                            compression=None, language=None):
+    """
+    Takes an XForm suvey object and generates the equivalent Floip Descriptor
+    file.
+    """
+    # Passes the keyword options through to survey_to_floip_descriptor.
+    # pylint: disable=too-many-arguments
+    return Package(
+        survey_to_floip_descriptor(survey, flow_id, created, modified, data,
+                                   compression=compression,
+                                   language=language))
 
 
 def xform_from_floip_dict(survey, name, values):
@@ -181,7 +256,8 @@ def xform_from_floip_dict(survey, name, values):
     survey - a pyxform Survey object
     name   - the floip question name or uuid
     values - the floip question object with the type, label and question
-             options for the question.
+             options for the question, the label is a string or an object of
+             label per language.
     """
     question_type = QUESTION_TYPES[values['type']]
     question_dict = {
@@ -205,50 +281,213 @@ def xform_from_floip_dict(survey, name, values):
         if 'bind' not in question_dict:
             question_dict['bind'] = {}
         question_dict['bind'].update({'constraint': constraint})
-    question = create_survey_element_from_dict(question_dict)
+    question = QUESTION_CLASSES[values['type']](**question_dict)
     survey.add_child(question)
 
     return question
 
 
+def _sort_attributes(node):
+    if node.attributes:
+        attributes = sorted(node.attributes.items())
+        for name, _value in attributes:
+            node.removeAttribute(name)
+        for name, value in attributes:
+            node.setAttribute(name, value)
+    for child in node.childNodes:
+        _sort_attributes(child)
+
+
+def pretty_xml(document):
+    """
+    Returns the XForm XML of a ``xml.dom.minidom`` document pretty printed
+    like pyxform does.
+    """
+    xml = PRETTY_TEXT_REGEX.sub(lambda m: ''.join(m.group(1, 2, 3)),
+                                document.toprettyxml(indent='  '))
+    xml = PRETTY_OUTPUT_REGEX.sub(r'\g<1>', xml)
+    xml = EMPTY_LABEL_REGEX.sub('<label></label>', xml)
+
+    return '<?xml version="1.0"?>\n' + xml
+
+
+def canonical_xml(survey):
+    """
+    Returns the pretty printed XForm XML of a pyxform `Survey` with the
+    attributes of every element sorted by name, the output does not depend on
+    the order pyxform sets attributes in.
+    """
+    document = survey.xml()
+    _sort_attributes(document)
+
+    return pretty_xml(document)
+
+
+def language_document(xml, language):
+    """
+    Returns the ``xml.dom.minidom`` document of multi-language XForm XML with
+    the itext labels of ``language`` inlined and the itext removed, the XForm
+    of the survey with its labels in ``language`` only.
+    """
+    document = minidom.parseString(xml).documentElement
+    texts = {}
+    for itext in document.getElementsByTagName('itext'):
+        for translation in itext.getElementsByTagName('translation'):
+            if translation.getAttribute('lang') != language:
+                continue
+            for text in translation.getElementsByTagName('text'):
+                for value in text.getElementsByTagName('value'):
+                    if not value.getAttribute('form'):
+                        texts[text.getAttribute('id')] = value
+        itext.parentNode.removeChild(itext)
+    for label in document.getElementsByTagName('label'):
+        match = ITEXT_REF_REGEX.match(label.getAttribute('ref'))
+        if match is None:
+            continue
+        label.removeAttribute('ref')
+        if match.group(1) in texts:
+            for child in texts[match.group(1)].childNodes:
+                label.appendChild(child.cloneNode(True))
+
+    return document
+
+
+def label_languages(questions, default=None):
+    """
+    Returns the languages of the labels of (name, question) pairs, ``default``
+    first when it is one of them or no label is an object of label per
+    language.
+    """
+    languages = set()
+    for _name, question in questions:
+        if isinstance(question.get('label'), dict):
+            languages.update(question['label'])
+    languages = sorted(languages)
+    if default in languages:
+        languages.remove(default)
+    elif languages:
+        return languages
+    return [default or DEFAULT_LANGUAGE] + languages
+
+
+def validate_xform(xml):
+    """
+    Validates XForm XML with ODK Validate, returns a list of warnings.
+    """
+    xform_file = tempfile.NamedTemporaryFile(suffix='.xml', delete=False)
+    try:
+        xform_file.write(xml.encode('utf-8'))
+        xform_file.close()
+        return check_xform(xform_file.name)
+    finally:
+        os.remove(xform_file.name)
+
+
+def question_items(questions):
+    """
+    Returns a list of (name, question) pairs, in descriptor order, from a
+    FLOIP ``questions`` object or array.
+    """
+    if isinstance(questions, dict):
+        return list(questions.items())
+    if isinstance(questions, list):
+        return [(name, question[name])
+                for question in questions for name in question]
+    raise ValidationError("Expecting 'questions' to be an object or array")
+
+
+def schema_questions(descriptor):
+    """
+    Returns the (name, question) pairs of the data resource of a FLOIP
+    descriptor dict or ``datapackage.Package``.
+    """
+    descriptor = getattr(descriptor, 'descriptor', descriptor)
+    try:
+        questions = descriptor['resources'][0]['schema']['questions']
+    except (KeyError, IndexError):
+        raise ValidationError(
+            "The 'questions' object is missing from the data resource")
+
+    return question_items(questions)
+
+
+def question_pairs(questions):
+    """
+    Returns the (name, question) pairs of a FLOIP descriptor dict, a
+    ``datapackage.Package`` or a ``questions`` object or array.
+    """
+    if hasattr(questions, 'descriptor') or \
+            (isinstance(questions, dict) and 'resources' in questions):
+        return schema_questions(questions)
+
+    return question_items(questions)
+
+
+def load_descriptor(descriptor):
+    """
+    Returns a FLOIP descriptor dict from a dict, a file object, a JSON string
+    or a file path.
+    """
+    if isinstance(descriptor, dict):
+        return copy.deepcopy(descriptor)
+    # Seek to begining of file if it has the seek attribute before loading
+    # the file.
+    if hasattr(descriptor, 'seek'):
+        descriptor.seek(0)
+    try:
+        # descriptor is a file
+        return json.load(descriptor)
+    except AttributeError:
+        try:
+            # descriptor is a JSON string
+            return json.loads(descriptor)
+        except JSONDecodeError:
+            # descriptor is a file path.
+            with codecs.open(descriptor, encoding='utf-8') as descriptor_file:
+                return json.load(descriptor_file)
+
+
 class FloipSurvey(object):
     """
     Converter of a FLOIP Result descriptor to Openrosa XForm.
+
+    canonical - sort questions given as an array by name and sort XML
+                attributes so that equal descriptors give identical XForms.
+    profiler  - a ``floip.memory.MemoryProfiler`` recording the ``load``,
+                ``package``, ``build``, ``serialize`` and ``validate`` phases.
+
+    Labels may be objects of label per language, the survey is built once
+    with every language and ``xml(language=...)`` renders the XForm of one
+    language from it.
     """
 
-    def __init__(self, descriptor=None, title=None, id_string=None):
-        # Seek to begining of file if it has the seek attribute before loading
-        # the file.
-        if hasattr(descriptor, 'seek'):
-            descriptor.seek(0)
-        try:
-            # descriptor is a file
-            self.descriptor = json.load(descriptor)
-        except AttributeError:
-            try:
-                # descriptor is a JSON string
-                self.descriptor = json.loads(descriptor)
-            except JSONDecodeError:
-                # descriptor is a file path.
-                self.descriptor = json.load(
-                    codecs.open(descriptor, encoding='utf-8'))
-
-        if self.descriptor['profile'] == FLOW_RESULTS_PROFILE:
-            del self.descriptor['profile']
-
-        self._package = Package(self.descriptor)
-        self.descriptor = self._package.descriptor
-        self._name = id_string or self._package.descriptor.get('name')
-        assert self._name, "The 'name' property must be defined."
-        title = title or self._package.descriptor.get('title') or self._name
+    def __init__(self, descriptor=None, title=None, id_string=None,
+                 canonical=False, profiler=None):
+        self._canonical = canonical
+        self._fingerprint = None
+        self._document_xml = None
+        self.languages = []
+        self.profiler = profiler
+        with profile_phase(profiler, 'load'):
+            descriptor = load_descriptor(descriptor)
+
+        if descriptor['profile'] == FLOW_RESULTS_PROFILE:
+            del descriptor['profile']
+
+        with profile_phase(profiler, 'package'):
+            self._package = Package(descriptor)
+        name = id_string or self.descriptor.get('name')
+        assert name, "The 'name' property must be defined."
+        title = title or self.descriptor.get('title') or name
         survey_dict = {
             constants.NAME: 'data',
-            constants.ID_STRING: self._name,
+            constants.ID_STRING: name,
             constants.TITLE: title,
             constants.TYPE: constants.SURVEY,
         }
-        self._survey = Survey(**survey_dict)
-        self.build()
+        with profile_phase(profiler, 'build'):
+            self._survey = Survey(**survey_dict)
+            self.build()
 
     def build(self):
         """
@@ -265,18 +504,15 @@ class FloipSurvey(object):
                 "The 'questions' object is missing from schema")
 
         questions = resource.descriptor['schema']['questions']
-        if isinstance(questions, dict):
-            question_keys = list(questions.keys())
-            question_keys.sort()
-            for name in question_keys:
-                xform_from_floip_dict(self._survey, name, questions[name])
-        elif isinstance(questions, list):
-            for question in questions:
-                for name in question:
-                    xform_from_floip_dict(self._survey, name, question[name])
-        else:
-            raise ValidationError(
-                "Expecting 'questions' to be an object or array")
+        items = question_items(questions)
+        if isinstance(questions, dict) or self._canonical:
+            items.sort(key=lambda item: item[0])
+        self.languages = label_languages(
+            items, resource.descriptor['schema'].get('language'))
+        if len(self.languages) > 1:
+            self._survey[constants.DEFAULT_LANGUAGE] = self.languages[0]
+        for name, values in items:
+            xform_from_floip_dict(self._survey, name, values)
 
         meta_dict = {
             "name": "meta",
@@ -304,6 +540,13 @@ class FloipSurvey(object):
         # check that we can recreate the survey object from the survey JSON
         create_survey_element_from_dict(self._survey.to_json_dict())
 
+    @property
+    def descriptor(self):
+        """
+        Returns the FLOIP Result descriptor dict of the datapackage.
+        """
+        return self._package.descriptor
+
     @property
     def survey(self):
         """
@@ -311,11 +554,57 @@ class FloipSurvey(object):
         """
         return self._survey
 
-    def xml(self):
+    @property
+    def fingerprint(self):
         """
-        Returns a XForm XML
+        Returns the SHA-256 hex digest of the canonical XForm XML, with the
+        questions sorted by name whatever ``canonical`` is, so it only changes
+        when the content of the XForm changes.
         """
-        return self._survey.to_xml()
+        if self._fingerprint is None:
+            survey = self._survey
+            names = [name for name, _question in question_items(
+                self.descriptor['resources'][0]['schema']['questions'])]
+            if not self._canonical and names != sorted(names):
+                survey = FloipSurvey(self.descriptor,
+                                     self._survey[constants.TITLE],
+                                     self._survey[constants.ID_STRING],
+                                     canonical=True,
+                                     profiler=self.profiler).survey
+            with profile_phase(self.profiler, 'serialize'):
+                self._fingerprint = hashlib.sha256(
+                    canonical_xml(survey).encode('utf-8')).hexdigest()
+        return self._fingerprint
+
+    def xml(self, validate=True, language=None):
+        """
+        Returns a XForm XML, validated with ODK Validate unless ``validate`` is
+        False. With a ``language`` the XForm has the labels of that language
+        only.
+        """
+        if language is not None:
+            if language not in self.languages:
+                raise ValidationError("Unknown language '%s'" % language)
+            with profile_phase(self.profiler, 'serialize'):
+                if self._document_xml is None:
+                    self._document_xml = self._survey.xml().toxml()
+                document = language_document(self._document_xml, language)
+                if self._canonical:
+                    _sort_attributes(document)
+                xml = pretty_xml(document)
+        elif self._canonical:
+            with profile_phase(self.profiler, 'serialize'):
+                xml = canonical_xml(self._survey)
+        elif self.profiler is not None:
+            with profile_phase(self.profiler, 'serialize'):
+                xml = self._survey.to_xml(validate=False)
+        else:
+            return self._survey.to_xml(validate=validate)
+        if validate:
+            with profile_phase(self.profiler, 'validate'):
+                validate_xform(xml)
+
+        return xml
 
     def survey_dict(self):
         """
@@ -0,0 +1,213 @@
+# -*- coding=utf-8 -*-
+"""
+Bulk XForm to FLOIP descriptor conversion.
+"""
+import codecs
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+import uuid
+
+import six
+from datapackage import Package
+
+from floip import survey_to_floip_descriptor
+from floip.utils import makedirs, utc_timestamp
+from floip.xform import read_xform
+
+XFORM_EXTENSIONS = ('.xml', '.xform')
+
+# id_strings name the descriptor files in the output directory.
+ID_STRING_REGEX = re.compile(r'\w[\w.-]*\Z', re.UNICODE)
+
+
+def stable_flow_id(id_string):
+    """
+    Returns a version 4 UUID string derived from a form's ``id_string`` so that
+    regenerating a descriptor keeps the same flow ``id``.
+    """
+    digest = hashlib.sha256(id_string.encode('utf-8')).digest()[:16]
+    return str(uuid.UUID(bytes=digest, version=4))
+
+
+def load_survey(source):
+    """
+    Returns a ``(survey, questions)`` pair from a survey dict, a pyxform survey
+    JSON file path or an XForm XML file path. ``questions`` is ``None`` unless
+    the source is an XForm, which is read without building a pyxform survey.
+    """
+    if isinstance(source, dict):
+        return source, None
+    if source.lower().endswith(XFORM_EXTENSIONS):
+        return read_xform(source)
+    with codecs.open(source, encoding='utf-8') as survey_file:
+        return json.load(survey_file), None
+
+
+def _source_name(source):
+    if isinstance(source, dict):
+        return source.get('id_string') or source.get('name')
+    return source
+
+
+class BatchResult(object):
+    """
+    Summary of a bulk conversion: written descriptors, per-form failures and
+    overall throughput.
+    """
+
+    def __init__(self):
+        self.converted = []
+        self.failures = []
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        """
+        Returns the number of seconds the conversion took.
+        """
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def total(self):
+        """
+        Returns the number of forms processed.
+        """
+        return len(self.converted) + len(self.failures)
+
+    @property
+    def throughput(self):
+        """
+        Returns the number of forms processed per second.
+        """
+        elapsed = self.elapsed
+        return self.total / elapsed if elapsed > 0 else float(self.total)
+
+
+class _Converter(object):  # pylint: disable=too-few-public-methods
+    """
+    Picklable per-form conversion callable shared by the worker processes.
+    """
+
+    def __init__(self, output_dir, created, modified, flow_ids, validate):
+        self.output_dir = output_dir
+        self.created = created
+        self.modified = modified
+        self.flow_ids = flow_ids or {}
+        self.validate = validate
+
+    def __call__(self, source):
+        name = _source_name(source)
+        id_string = None
+        try:
+            survey, questions = load_survey(source)
+            id_string = survey['id_string']
+            if not isinstance(id_string, six.string_types) or \
+                    not ID_STRING_REGEX.match(id_string):
+                raise ValueError('Invalid id_string %r' % (id_string, ))
+            flow_id = self.flow_ids.get(id_string) or stable_flow_id(id_string)
+            descriptor = survey_to_floip_descriptor(
+                survey, flow_id, self.created, self.modified,
+                id_string + '-data.json', questions=questions)
+            if self.validate:
+                package = Package(descriptor)
+                if not package.valid:
+                    raise ValueError('; '.join(
+                        six.text_type(error) for error in package.errors))
+            # the main process renames the descriptor to <id_string>.json
+            # once it knows no other form has the same id_string.
+            handle, tmp_path = tempfile.mkstemp(
+                suffix='.tmp', dir=self.output_dir)
+            os.close(handle)
+            with codecs.open(tmp_path, 'w',
+                             encoding='utf-8') as descriptor_file:
+                json.dump(descriptor, descriptor_file, indent=2,
+                          sort_keys=True)
+        except Exception as error:  # pylint: disable=broad-except
+            return name, id_string, None, '%s: %s' % (type(error).__name__,
+                                                      error)
+
+        return name, id_string, tmp_path, None
+
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _collect(outcomes, output_dir, result):
+    """
+    Renames the descriptors of the converted forms to ``<id_string>.json`` in
+    ``output_dir`` and records each form in a ``BatchResult``.
+    """
+    sources = {}
+    for name, id_string, tmp_path, error in outcomes:
+        if not error and id_string in sources:
+            error = "Duplicate id_string '%s', also in %s" % (
+                id_string, sources[id_string])
+        if not error:
+            path = os.path.join(output_dir, id_string + '.json')
+            try:
+                getattr(os, 'replace', os.rename)(tmp_path, path)
+            except OSError as rename_error:
+                error = '%s: %s' % (type(rename_error).__name__,
+                                    rename_error)
+            else:
+                sources[id_string] = name
+                result.converted.append((name, path))
+                continue
+        if tmp_path is not None:
+            _discard(tmp_path)
+        result.failures.append((name, error))
+
+
+def convert_surveys(surveys, output_dir, created=None, modified=None,
+                    flow_ids=None, workers=None, validate=False,
+                    chunksize=16):
+    """
+    Converts a stream of pyxform survey dicts or XForm/survey JSON file paths
+    to FLOIP descriptors written to ``output_dir`` as ``<id_string>.json``.
+
+    surveys   - an iterable of survey dicts or file paths
+    flow_ids  - optional mapping of ``id_string`` to flow ``id``, forms not in
+                the mapping get an ``id`` derived from their ``id_string``
+    workers   - number of worker processes, defaults to the CPU count, ``1``
+                converts in the current process
+    validate  - validate each descriptor against the data package profile
+
+    Returns a ``BatchResult``; a failing form does not stop the batch. A form
+    with the same ``id_string`` as a form converted before it fails, its
+    descriptor would overwrite the other one, and so does a form whose
+    ``id_string`` is not a file name of letters, digits, ``_``, ``.`` and
+    ``-``.
+    """
+    # the conversion options of the public API, passed on to each worker.
+    # pylint: disable=too-many-arguments
+    makedirs(output_dir)
+    timestamp = utc_timestamp()
+    converter = _Converter(output_dir, created or timestamp,
+                           modified or timestamp, flow_ids, validate)
+    result = BatchResult()
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1:
+        outcomes = six.moves.map(converter, surveys)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers)
+        outcomes = pool.imap_unordered(converter, surveys, chunksize)
+    try:
+        _collect(outcomes, output_dir, result)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    result.finished = time.time()
+
+    return result
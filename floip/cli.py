@@ -2,17 +2,144 @@
 """
 Command line FLOIP XForm converter.
 """
+import sys
 
 import click
 
 from floip import FloipSurvey
+from floip.batch import convert_surveys
+from floip.memory import MemoryProfiler
+from floip.shard import ShardJob
+from floip.sqlite import BATCH_SIZE, load_package
 
+DEFAULT_COMMAND = 'xform'
 
-@click.command()
+
+class FloipGroup(click.Group):  # pylint: disable=too-few-public-methods
+    """
+    Command group that runs the ``xform`` command when the first argument is
+    not a subcommand, so ``floip DESCRIPTOR`` keeps working.
+    """
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and \
+                not args[0].startswith('-'):
+            args.insert(0, DEFAULT_COMMAND)
+        return super(FloipGroup, self).parse_args(ctx, args)
+
+
+@click.group(cls=FloipGroup)
+def cli():
+    """
+    FLOIP results data package and XForm converter.
+    """
+    pass
+
+
+@cli.command(DEFAULT_COMMAND)
 @click.argument('descriptor')
-def cli(descriptor):
+@click.option('--canonical', is_flag=True,
+              help='Output the XForm with sorted questions and attributes.')
+@click.option('--fingerprint', is_flag=True,
+              help='Output only the fingerprint of the canonical XForm.')
+@click.option('--profile-memory', is_flag=True,
+              help='Report the peak memory and top allocation sites of each '
+              'conversion phase to stderr.')
+def xform(descriptor, canonical, fingerprint, profile_memory):
     """
     Outputs the XForm of a given FlOIP results data package descriptor.
     """
-    survey = FloipSurvey(descriptor)
-    click.echo(survey.xml())
+    profiler = MemoryProfiler() if profile_memory else None
+    survey = FloipSurvey(
+        descriptor, canonical=canonical or fingerprint, profiler=profiler)
+    if fingerprint:
+        click.echo(survey.fingerprint)
+    else:
+        click.echo(survey.xml())
+    if profiler is not None:
+        click.echo(profiler.report(), err=True)
+
+
+@cli.command()
+@click.argument('output_dir')
+@click.argument('sources', nargs=-1)
+@click.option('--workers', '-w', type=int, default=None,
+              help='Number of worker processes, defaults to the CPU count.')
+@click.option('--validate', is_flag=True,
+              help='Validate each descriptor against the package profile.')
+def batch(output_dir, sources, workers, validate):
+    """
+    Writes FLOIP descriptors for many XForm or pyxform survey JSON files.
+
+    SOURCES are file paths, or '-' to read one path per line from stdin.
+    """
+    if not sources or sources == ('-', ):
+        sources = (line.strip() for line in sys.stdin if line.strip())
+    result = convert_surveys(
+        sources, output_dir, workers=workers, validate=validate)
+    for name, error in result.failures:
+        click.echo('FAILED %s: %s' % (name, error), err=True)
+    click.echo('%d converted, %d failed in %.2fs (%.1f forms/s)' % (
+        len(result.converted), len(result.failures), result.elapsed,
+        result.throughput))
+    if result.failures:
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument('descriptor')
+@click.argument('database')
+@click.option('--base-path', default=None,
+              help='Directory the data resource path is relative to, '
+              "defaults to the descriptor's directory.")
+@click.option('--table', default=None,
+              help='Table name, defaults to the descriptor name.')
+@click.option('--batch-size', type=int, default=BATCH_SIZE,
+              help='Number of rows loaded per transaction.')
+def sqlite(descriptor, database, base_path, table, batch_size):
+    """
+    Loads the data of a FLOIP results data package into a SQLite database.
+    """
+    loader = load_package(descriptor, database, base_path, table, batch_size)
+    click.echo('%d rows loaded into %s in %.2fs (%.0f rows/s)' % (
+        loader.rows, loader.table, loader.elapsed, loader.rows_per_second))
+
+
+@cli.command()
+@click.argument('descriptor')
+@click.argument('output')
+@click.option('--base-path', default=None,
+              help='Directory the data resource path is relative to.')
+@click.option('--work-dir', default=None,
+              help='Directory of the shard outputs and progress files, '
+              'defaults to OUTPUT.shards.')
+@click.option('--shards', type=int, default=None,
+              help='Number of shards, defaults to the CPU count.')
+@click.option('--shard', 'indexes', type=int, multiple=True,
+              help='Convert only this shard, may be repeated.')
+@click.option('--workers', '-w', type=int, default=None,
+              help='Number of worker processes, defaults to the CPU count.')
+@click.option('--no-merge', is_flag=True,
+              help='Do not merge the shard outputs into OUTPUT.')
+def submissions(descriptor, output, base_path, work_dir, shards, indexes,
+                workers, no_merge):
+    """
+    Converts the data of a FLOIP results data package to form submissions in
+    resumable shards, rerun it to retry failed shards.
+    """
+    # click passes every option as an argument.
+    # pylint: disable=too-many-arguments
+    job = ShardJob(descriptor, work_dir or output + '.shards', shards,
+                   base_path)
+    result = job.run(indexes or None, workers)
+    for index, error in result.failures:
+        click.echo('FAILED shard %d: %s' % (index, error), err=True)
+    pending = job.pending()
+    click.echo('%d shards converted, %d failed, %d pending in %.2fs' % (
+        len(result.converted), len(result.failures), len(pending),
+        result.elapsed))
+    if result.failures:
+        sys.exit(1)
+    if not pending and not no_merge:
+        click.echo('%d submissions written to %s' % (job.merge(output),
+                                                     output))
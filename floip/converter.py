@@ -0,0 +1,98 @@
+# -*- coding=utf-8 -*-
+"""
+Thread-safe reusable FLOIP converter.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from floip import (FloipSurvey, load_descriptor, survey_to_floip_descriptor,
+                   survey_to_floip_package)
+
+
+class FloipConverter(object):
+    """
+    Thread-safe converter of FLOIP results descriptors to XForms and of XForm
+    surveys to FLOIP descriptors.
+
+    A converter only holds a bounded LRU cache of generated XForms guarded by
+    a lock. The question type tables, such as ``floip.QUESTION_CLASSES``, are
+    module level constants, and each conversion builds its own pyxform survey
+    including the meta group, since pyxform mutates survey elements while
+    rendering them. One instance can be shared by all the threads of a web
+    service.
+
+    canonical  - generate canonical XForms, see ``FloipSurvey``
+    validate   - validate generated XForms with ODK Validate
+    cache_size - number of XForms to keep in the cache, ``0`` disables it
+    """
+
+    def __init__(self, canonical=True, validate=True, cache_size=128):
+        self.canonical = canonical
+        self.validate = validate
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _cache_key(descriptor, title, id_string):
+        content = json.dumps([descriptor, title, id_string], sort_keys=True)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def survey(self, descriptor, title=None, id_string=None):
+        """
+        Returns a new ``FloipSurvey`` of a FLOIP descriptor.
+        """
+        return FloipSurvey(descriptor, title, id_string,
+                           canonical=self.canonical)
+
+    def xml(self, descriptor, title=None, id_string=None):
+        """
+        Returns the XForm XML of a FLOIP descriptor dict, file, JSON string or
+        file path, from the cache when the same descriptor was converted
+        before.
+        """
+        descriptor = load_descriptor(descriptor)
+        key = self._cache_key(descriptor, title, id_string)
+        with self._lock:
+            xml = self._cache.pop(key, None)
+            if xml is not None:
+                self.hits += 1
+                self._cache[key] = xml
+                return xml
+            self.misses += 1
+
+        xml = self.survey(descriptor, title, id_string).xml(self.validate)
+        if self.cache_size:
+            with self._lock:
+                self._cache[key] = xml
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return xml
+
+    def clear(self):
+        """
+        Empties the XForm cache.
+        """
+        with self._lock:
+            self._cache.clear()
+
+    @staticmethod
+    def floip_descriptor(survey, flow_id, created, modified, data=None):
+        """
+        Returns the FLOIP descriptor dict of a pyxform survey dict.
+        """
+        return survey_to_floip_descriptor(survey, flow_id, created, modified,
+                                          data)
+
+    @staticmethod
+    def floip_package(survey, flow_id, created, modified, data=None):
+        """
+        Returns the FLOIP ``datapackage.Package`` of a pyxform survey dict.
+        """
+        return survey_to_floip_package(survey, flow_id, created, modified,
+                                       data)
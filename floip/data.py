@@ -0,0 +1,253 @@
+# -*- coding=utf-8 -*-
+"""
+Streaming reading and writing of Flow Results data resources.
+
+A data resource is a JSON array of rows, each row an array of ``timestamp``,
+``row_id``, ``contact_id``, ``session_id``, ``question_id``, ``response`` and
+``response_metadata``. Resources may be gzip, zstd or lz4 compressed.
+"""
+import codecs
+import gzip
+import io
+import json
+import os
+import re
+
+import six
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # pylint: disable=invalid-name
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None  # pylint: disable=invalid-name
+
+CHUNK_SIZE = 64 * 1024
+
+FIELDS = ('timestamp', 'row_id', 'contact_id', 'session_id', 'question_id',
+          'response', 'response_metadata')
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+LZ4 = 'lz4'
+
+# Compression names and aliases accepted in a resource's ``compression``.
+COMPRESSION_NAMES = {
+    'gz': GZIP,
+    GZIP: GZIP,
+    'zst': ZSTD,
+    ZSTD: ZSTD,
+    LZ4: LZ4
+}
+
+COMPRESSION_EXTENSIONS = {'.gz': GZIP, '.zst': ZSTD, '.lz4': LZ4}
+
+# gzip level 6 writes about twice as fast as level 9 for a 10% larger file.
+GZIP_LEVEL = 6
+
+WHITESPACE_REGEX = re.compile(r'\s*')
+
+# python 2 JSON errors only have the error position in their message.
+ERROR_POSITION_REGEX = re.compile(r'\(char (\d+)')
+
+# Longest prefix of a JSON literal, ``-Infinity``, a decoding error can start
+# at when a chunk ends in the middle of it.
+LITERAL_PREFIX = 16
+
+# ``iter_rows`` states, expecting the opening bracket, the first row or the
+# closing bracket, a row after a comma and a comma or the closing bracket, and
+# the end of the array.
+_START, _FIRST, _ROW, _NEXT, _END = range(5)
+
+# ``iter_rows`` state after a bracket or a comma in a state.
+_TRANSITIONS = {
+    (_START, '['): _FIRST,
+    (_FIRST, ']'): _END,
+    (_NEXT, ','): _ROW,
+    (_NEXT, ']'): _END
+}
+
+_EXPECTING = {
+    _START: 'Expecting a JSON array of rows',
+    _FIRST: 'Expecting a row',
+    _ROW: 'Expecting a row',
+    _NEXT: "Expecting ',' delimiter after a row"
+}
+
+
+def data_compression(path, compression=None):
+    """
+    Returns the compression of a data file from a ``compression`` hint or the
+    file extension, ``None`` for uncompressed files.
+    """
+    if compression:
+        try:
+            return COMPRESSION_NAMES[compression.lower()]
+        except KeyError:
+            raise ValueError('Unsupported compression %r' % compression)
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def open_data(path, mode='rb', compression=None, level=None):
+    """
+    Opens a data file in binary ``mode``, compressed or decompressed as it is
+    written or read. zstd requires the ``zstandard`` package and lz4 the
+    ``lz4`` package.
+    """
+    compression = data_compression(path, compression)
+    if compression is None:
+        return io.open(path, mode)
+    if compression == GZIP:
+        return gzip.open(path, mode, GZIP_LEVEL if level is None else level)
+    if compression == ZSTD:
+        if zstandard is None:
+            raise ImportError("zstd compression requires 'zstandard'")
+        cctx = None
+        if level is not None:
+            cctx = zstandard.ZstdCompressor(level=level)
+        return zstandard.open(path, mode, cctx=cctx)
+    if lz4_frame is None:
+        raise ImportError("lz4 compression requires 'lz4'")
+    return lz4_frame.open(path, mode, compression_level=level or 0)
+
+
+def _incomplete(error, text):
+    """
+    Returns whether a JSON decoding error of ``text`` is at its end, that is
+    whether reading more data may fix it.
+    """
+    if str(error).startswith('Unterminated string'):
+        return True
+    pos = getattr(error, 'pos', None)
+    if pos is None:
+        match = ERROR_POSITION_REGEX.search(str(error))
+        if match is None:
+            return False
+        pos = int(match.group(1))
+
+    return pos >= len(text) - LITERAL_PREFIX
+
+
+def iter_rows(data_file, chunk_size=CHUNK_SIZE):
+    """
+    Returns an iterator of the rows in a Flow Results data file object,
+    reading and decoding ``chunk_size`` bytes at a time. Raises a
+    ``ValueError`` as soon as the data is not a JSON array of rows.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buf = u''
+    pos = 0
+    eof = False
+    state = _START
+    while True:
+        pos = WHITESPACE_REGEX.match(buf, pos).end()
+        if pos < len(buf):
+            char = buf[pos]
+            if (state, char) in _TRANSITIONS:
+                state = _TRANSITIONS[(state, char)]
+                if state == _END:
+                    return
+                pos += 1
+                continue
+            if state in (_START, _NEXT) or char in ',]':
+                raise ValueError(_EXPECTING[state])
+            try:
+                row, pos = decoder.raw_decode(buf, pos)
+            except ValueError as error:
+                if eof or not _incomplete(error, buf):
+                    raise
+            else:
+                state = _NEXT
+                yield row
+                continue
+        elif eof:
+            raise ValueError('Unexpected end of data')
+        chunk = data_file.read(chunk_size)
+        eof = not chunk
+        if isinstance(chunk, bytes):
+            chunk = text_decoder.decode(chunk, eof)
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def read_data(path, compression=None, chunk_size=CHUNK_SIZE):
+    """
+    Returns an iterator of the rows in a, possibly compressed, Flow Results
+    data file.
+    """
+    with open_data(path, 'rb', compression) as data_file:
+        for row in iter_rows(data_file, chunk_size):
+            yield row
+
+
+def dump_row(row):
+    """
+    Returns the JSON line of a row, as written by ``write_rows``.
+    """
+    return json.dumps(row, separators=(',', ':'))
+
+
+def write_rows(data_file, rows):
+    """
+    Writes rows to a binary data file object as a JSON array with one row per
+    line, returns the number of rows written.
+    """
+    count = 0
+    data_file.write(b'[')
+    for row in rows:
+        line = (u',\n' if count else u'\n') + dump_row(row)
+        data_file.write(line.encode('utf-8'))
+        count += 1
+    data_file.write(b'\n]\n')
+
+    return count
+
+
+def write_data(path, rows, compression=None, level=None):
+    """
+    Writes rows to a, possibly compressed, Flow Results data file, returns the
+    number of rows written.
+    """
+    with open_data(path, 'wb', compression, level) as data_file:
+        return write_rows(data_file, rows)
+
+
+def resource_data_path(descriptor, base_path=None):
+    """
+    Returns the ``(path, compression)`` of the data resource of a FLOIP
+    descriptor dict or ``datapackage.Package``.
+    """
+    descriptor = getattr(descriptor, 'descriptor', descriptor)
+    resource = descriptor['resources'][0]
+    path = resource['path']
+    if base_path and not os.path.isabs(path):
+        path = os.path.join(base_path, path)
+
+    return path, data_compression(path, resource.get('compression'))
+
+
+def descriptor_base_path(descriptor, base_path=None):
+    """
+    Returns the directory the relative data resource paths of a descriptor
+    are relative to: ``base_path`` when given, else the directory of a
+    descriptor given as a file path.
+    """
+    if base_path is None and isinstance(descriptor, six.string_types) and \
+            os.path.isfile(descriptor):
+        return os.path.dirname(descriptor)
+
+    return base_path
+
+
+def read_resource(descriptor, base_path=None, chunk_size=CHUNK_SIZE):
+    """
+    Returns an iterator of the rows in the data resource of a FLOIP
+    descriptor, ``base_path`` is the directory relative paths are in.
+    """
+    path, compression = resource_data_path(descriptor, base_path)
+
+    return read_data(path, compression, chunk_size)
@@ -0,0 +1,198 @@
+# -*- coding=utf-8 -*-
+"""
+Incremental export of form submissions to a Flow Results data package.
+"""
+import codecs
+import io
+import json
+import os
+from collections import OrderedDict
+
+import six
+
+from floip import survey_questions, survey_to_floip_descriptor
+from floip.data import data_compression, dump_row
+from floip.utils import utc_timestamp, write_json
+
+# Bytes closing the JSON array of a data file written by ``write_rows``.
+DATA_TAIL = b'\n]\n'
+
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+# Keys of the timestamp and the id of form submissions.
+SUBMISSION_KEYS = ('_submission_time', '_id')
+
+
+def submission_rows(submission, questions, timestamp_key=SUBMISSION_KEYS[0],
+                    id_key=SUBMISSION_KEYS[1]):
+    """
+    Returns an iterator of the Flow Results rows of a form submission, one row
+    per answered question. Submissions are flat dicts keyed by question name,
+    with ``meta/contactID`` and ``meta/sessionID`` (or ``meta/instanceID``)
+    identifying the contact and session.
+    """
+    timestamp = submission[timestamp_key]
+    submission_id = submission[id_key]
+    contact_id = submission.get('meta/contactID')
+    session_id = submission.get('meta/sessionID') or \
+        submission.get('meta/instanceID')
+    for name, question in questions.items():
+        if name not in submission:
+            continue
+        response = submission[name]
+        if question['type'] == 'select_many' and \
+                isinstance(response, six.string_types):
+            response = response.split()
+        yield [
+            timestamp, '%s-%s' % (submission_id, name), contact_id,
+            session_id, name, response, {}
+        ]
+
+
+class IncrementalExporter(object):
+    """
+    Appends form submissions newer than the last export to a Flow Results
+    data resource.
+
+    A checkpoint file next to the data file keeps the high-water mark, the
+    ``(timestamp, id)`` of the newest exported submission, and the size of the
+    data file when the checkpoint was written. Rows written after the last
+    checkpoint, by an export that crashed, are truncated before appending so
+    that an export can always be rerun.
+
+    survey    - pyxform survey dict of the form
+    flow_id   - version 4 UUID of the flow
+    path      - path the descriptor is written to
+    data_path - path of the data file, defaults to ``<path>-data.json``, it
+                can not be compressed
+    keys      - the ``(timestamp, id)`` keys of the submissions
+    """
+
+    def __init__(self, survey, flow_id, path, data_path=None,
+                 keys=SUBMISSION_KEYS):
+        self.survey = survey
+        self.flow_id = flow_id
+        self.path = path
+        self.data_path = data_path or \
+            os.path.splitext(path)[0] + '-data.json'
+        if data_compression(self.data_path) is not None:
+            raise ValueError('Compressed data files can not be appended to.')
+        self.keys = keys
+        self.checkpoint = self._load_checkpoint()
+
+    @property
+    def checkpoint_path(self):
+        """
+        Returns the path of the checkpoint file, next to the data file.
+        """
+        return self.data_path + CHECKPOINT_SUFFIX
+
+    @property
+    def questions(self):
+        """
+        Returns the questions of the survey, by name.
+        """
+        return OrderedDict(survey_questions(self.survey['children']))
+
+    def _load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            with codecs.open(self.checkpoint_path,
+                             encoding='utf-8') as checkpoint_file:
+                return json.load(checkpoint_file)
+
+        return {
+            'created': utc_timestamp(),
+            'modified': None,
+            'timestamp': None,
+            'id': None,
+            'rows': 0,
+            'size': 0
+        }
+
+    @property
+    def high_water_mark(self):
+        """
+        Returns the ``(timestamp, id)`` of the newest exported submission.
+        """
+        return self.checkpoint['timestamp'], self.checkpoint['id']
+
+    def _key(self, submission):
+        return submission[self.keys[0]], submission[self.keys[1]]
+
+    def _is_new(self, submission):
+        if self.checkpoint['timestamp'] is None:
+            return True
+        return self._key(submission) > self.high_water_mark
+
+    def _append(self, rows):
+        """
+        Appends rows to the data file, returns ``(rows, size)`` after writing.
+        """
+        count = self.checkpoint['rows']
+        size = self.checkpoint['size']
+        if not size:
+            with io.open(self.data_path, 'wb') as data_file:
+                data_file.write(b'[' + DATA_TAIL)
+            size = len(DATA_TAIL) + 1
+        elif os.path.getsize(self.data_path) < size:
+            raise ValueError('%s is smaller than its checkpoint.' %
+                             self.data_path)
+        with io.open(self.data_path, 'r+b') as data_file:
+            # drop the closing bracket and anything an interrupted export
+            # wrote after the last checkpoint.
+            data_file.truncate(size - len(DATA_TAIL))
+            data_file.seek(0, os.SEEK_END)
+            for row in rows:
+                data_file.write(
+                    ((u',\n' if count else u'\n') + dump_row(row))
+                    .encode('utf-8'))
+                count += 1
+            data_file.write(DATA_TAIL)
+            data_file.flush()
+            os.fsync(data_file.fileno())
+            size = data_file.tell()
+
+        return count, size
+
+    def descriptor(self):
+        """
+        Returns the FLOIP descriptor of the exported data.
+        """
+        data = os.path.relpath(
+            self.data_path, os.path.dirname(os.path.abspath(self.path)))
+        return survey_to_floip_descriptor(
+            self.survey, self.flow_id, self.checkpoint['created'],
+            self.checkpoint['modified'] or self.checkpoint['created'], data)
+
+    def export(self, submissions, modified=None):
+        """
+        Appends the rows of submissions newer than the high-water mark, then
+        updates the checkpoint and the descriptor ``modified`` field. Returns
+        the number of rows appended.
+        """
+        checkpoint = dict(self.checkpoint)
+        mark = self.high_water_mark
+        questions = self.questions
+
+        def _rows():
+            for submission in submissions:
+                if not self._is_new(submission):
+                    continue
+                key = self._key(submission)
+                if checkpoint['timestamp'] is None or \
+                        key > (checkpoint['timestamp'], checkpoint['id']):
+                    checkpoint['timestamp'], checkpoint['id'] = key
+                for row in submission_rows(submission, questions,
+                                           *self.keys):
+                    yield row
+
+        rows, size = self._append(_rows())
+        appended = rows - self.checkpoint['rows']
+        if appended or (checkpoint['timestamp'], checkpoint['id']) != mark:
+            checkpoint['modified'] = modified or utc_timestamp()
+        checkpoint.update({'rows': rows, 'size': size})
+        write_json(self.checkpoint_path, checkpoint)
+        self.checkpoint = checkpoint
+        write_json(self.path, self.descriptor())
+
+        return appended
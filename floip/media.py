@@ -0,0 +1,297 @@
+# -*- coding=utf-8 -*-
+"""
+Media attachments of Flow Results image, audio and video responses.
+"""
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from six.moves.urllib.parse import urlparse
+from six.moves.urllib.request import url2pathname
+
+from floip import question_pairs
+
+MEDIA_TYPES = ('image', 'audio', 'video')
+
+BATCH_SIZE = 100
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path):
+    """
+    Returns the SHA-256 hex digest of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as media_file:
+        for chunk in iter(lambda: media_file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _copy_file(path, target):
+    """
+    Copies a file to ``target`` through a temporary file in the same
+    directory, so ``target`` never holds a partial copy.
+    """
+    handle, tmp_path = tempfile.mkstemp(suffix='.tmp',
+                                        dir=os.path.dirname(target))
+    os.close(handle)
+    try:
+        shutil.copyfile(path, tmp_path)
+        getattr(os, 'replace', os.rename)(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class MediaStats(object):
+    """
+    Counters of a ``MediaStage``.
+
+    files        - number of media files attached
+    bytes        - number of bytes of the media files attached
+    stored       - number of files written to the output directory
+    deduplicated - number of files with the content of a stored file
+    missing      - paths of the media files that do not exist
+    rejected     - responses resolving outside the source
+    elapsed      - seconds spent attaching media
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.stored = 0
+        self.deduplicated = 0
+        self.missing = []
+        self.rejected = []
+        self.elapsed = 0.0
+
+    @property
+    def files_per_second(self):
+        """
+        Returns the number of media files attached per second.
+        """
+        return self.files / self.elapsed if self.elapsed else float(self.files)
+
+    @property
+    def bytes_per_second(self):
+        """
+        Returns the number of media bytes attached per second.
+        """
+        return self.bytes / self.elapsed if self.elapsed else float(self.bytes)
+
+
+class _MediaStore(object):
+    """
+    Thread-safe store of media files named by the SHA-256 digest of their
+    content in ``output_dir``.
+    """
+
+    def __init__(self, output_dir, link=True):
+        self.output_dir = output_dir
+        self.link = link
+        self._digests = {}
+        self._stored = set()
+        self._storing = {}
+        self._lock = threading.Lock()
+
+    def digest(self, path):
+        """
+        Returns the digest of a file, computed once per path.
+        """
+        with self._lock:
+            digest = self._digests.get(path)
+        if digest is None:
+            digest = file_digest(path)
+            with self._lock:
+                self._digests[path] = digest
+
+        return digest
+
+    def store(self, path, digest):
+        """
+        Hardlinks or copies a file to the output directory unless a file with
+        the same digest is there, returns ``(name, stored)``. Threads storing
+        the same digest wait for the first one, and take over if it failed.
+        """
+        name = digest + os.path.splitext(path)[1].lower()
+        target = os.path.join(self.output_dir, name)
+        with self._lock:
+            if digest in self._stored:
+                return name, False
+            storing = self._storing.get(digest)
+            if storing is None:
+                storing = self._storing[digest] = threading.Event()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            storing.wait()
+            return self.store(path, digest)
+        try:
+            stored = not os.path.exists(target)
+            if stored:
+                try:
+                    if not self.link:
+                        raise OSError(errno.EXDEV, 'hardlinks disabled')
+                    os.link(path, target)
+                except OSError as error:
+                    if error.errno == errno.EEXIST:
+                        stored = False
+                    else:
+                        _copy_file(path, target)
+            with self._lock:
+                self._stored.add(digest)
+        finally:
+            with self._lock:
+                del self._storing[digest]
+            storing.set()
+
+        return name, stored
+
+
+class MediaStage(object):
+    """
+    Attaches the media files of image, audio and video responses to form
+    submissions.
+
+    Responses are resolved against ``source``, a local directory or a
+    ``file://`` URL base. Responses are untrusted, those resolving outside
+    ``source`` after following symlinks are not attached but added to
+    ``stats.rejected``. Each file is hardlinked, or copied when hardlinking
+    fails, into ``output_dir`` as ``<sha256><extension>`` by a pool of
+    ``workers`` threads, so a file referenced many times or with the same
+    content as another file is stored once. The response is replaced by the
+    stored file name and the submission gets an ``_attachments`` list.
+
+    questions - the questions, see ``floip.question_pairs``
+    """
+
+    def __init__(self, questions, source, output_dir, workers=8, link=True):
+        questions = question_pairs(questions)
+        self.media_questions = [
+            name for name, question in questions
+            if question.get('type') in MEDIA_TYPES
+        ]
+        if source.startswith('file:'):
+            source = url2pathname(urlparse(source).path)
+        self.source = source
+        self._root = os.path.join(os.path.realpath(source), '')
+        self.workers = workers
+        self.stats = MediaStats()
+        self._media_store = _MediaStore(output_dir, link)
+
+    @property
+    def output_dir(self):
+        """
+        Returns the directory the media files are stored in.
+        """
+        return self._media_store.output_dir
+
+    def resolve(self, response):
+        """
+        Returns the real local path of a media response, raises a
+        ``ValueError`` when it is not in ``source``.
+        """
+        if response.startswith('file:'):
+            response = url2pathname(urlparse(response).path)
+        path = os.path.realpath(os.path.join(self.source, response))
+        if not path.startswith(self._root):
+            raise ValueError('%s is not in %s' % (response, self.source))
+
+        return path
+
+    def _resolve(self, response):
+        try:
+            return self.resolve(response)
+        except ValueError:
+            return None
+
+    def _attach(self, path):
+        """
+        Stores a media file, returns ``(attachment, stored)``, ``(None,
+        False)`` when the file does not exist. Errors writing to the output
+        directory are raised.
+        """
+        try:
+            size = os.path.getsize(path)
+            digest = self._media_store.digest(path)
+        except (IOError, OSError) as error:
+            if error.errno == errno.ENOENT:
+                return None, False
+            raise
+        name, stored = self._media_store.store(path, digest)
+
+        return {
+            'filename': name,
+            'path': os.path.join(self.output_dir, name),
+            'sha256': digest,
+            'size': size
+        }, stored
+
+    def _attach_batch(self, pool, batch):
+        started = time.time()
+        paths = sorted(set(
+            self._resolve(submission[name])
+            for submission in batch for name in self.media_questions
+            if submission.get(name)) - set([None]))
+        attachments = {}
+        for path, (attachment, stored) in zip(paths,
+                                              pool.map(self._attach, paths)):
+            attachments[path] = attachment
+            if attachment is not None:
+                self.stats.files += 1
+                self.stats.bytes += attachment['size']
+                if stored:
+                    self.stats.stored += 1
+                else:
+                    self.stats.deduplicated += 1
+        for submission in batch:
+            submission_attachments = []
+            for name in self.media_questions:
+                if not submission.get(name):
+                    continue
+                path = self._resolve(submission[name])
+                if path is None:
+                    self.stats.rejected.append(submission[name])
+                    continue
+                attachment = attachments[path]
+                if attachment is None:
+                    self.stats.missing.append(path)
+                    continue
+                submission[name] = attachment['filename']
+                submission_attachments.append(dict(attachment, question=name))
+            submission['_attachments'] = submission_attachments
+        self.stats.elapsed += time.time() - started
+
+        return batch
+    def attach(self, submissions, batch_size=BATCH_SIZE):
+        """
+        Returns an iterator of submissions with their media attached,
+        processing ``batch_size`` submissions at a time. Media files that do
+        not exist are added to ``stats.missing`` and their responses left as
+        is.
+        """
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        pool = ThreadPool(self.workers)
+        batch = []
+        try:
+            for submission in submissions:
+                batch.append(submission)
+                if len(batch) >= batch_size:
+                    for attached in self._attach_batch(pool, batch):
+                        yield attached
+                    batch = []
+            for attached in self._attach_batch(pool, batch):
+                yield attached
+        finally:
+            pool.close()
+            pool.join()
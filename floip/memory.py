@@ -0,0 +1,135 @@
+# -*- coding=utf-8 -*-
+"""
+Memory profiling of conversion phases with ``tracemalloc``.
+"""
+import time
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2 does not have tracemalloc.
+    tracemalloc = None  # pylint: disable=invalid-name
+
+TOP_ALLOCATIONS = 10
+
+
+def format_size(size):
+    """
+    Returns a human readable number of bytes.
+    """
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024.0
+
+    return '%.1f GiB' % size
+
+
+class PhaseStats(object):  # pylint: disable=too-few-public-methods
+    """
+    Memory used by a profiled phase.
+
+    peak     - highest traced memory during the phase above the memory traced
+               when it started, in bytes
+    retained - memory still allocated at the end of the phase, in bytes
+    top      - ``(site, size, count)`` of the ``file:line`` sites that
+               allocated most of the retained memory
+    """
+
+    def __init__(self, name, peak, retained, top, elapsed):
+        self.name = name
+        self.peak = peak
+        self.retained = retained
+        self.top = top
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return '<PhaseStats %s peak=%d retained=%d>' % (self.name, self.peak,
+                                                        self.retained)
+
+
+class MemoryProfiler(object):
+    """
+    Records the peak memory and the top allocation sites of named phases.
+
+    Phases are profiled in a ``with profiler.phase(name):`` block, tracing is
+    started for the block unless ``tracemalloc`` is already tracing. Tracing
+    slows allocations down several times, timings of profiled phases are only
+    comparable with each other.
+    """
+
+    def __init__(self, top=TOP_ALLOCATIONS):
+        if tracemalloc is None:
+            raise ImportError('Memory profiling requires tracemalloc')
+        self.top = top
+        self.phases = []
+
+    @property
+    def peak(self):
+        """
+        Returns the highest peak of the profiled phases, in bytes.
+        """
+        return max([stats.peak for stats in self.phases] or [0])
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)
+        ])
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Profiles the memory allocated in a ``with`` block.
+        """
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        before = self._snapshot()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        start, _peak = tracemalloc.get_traced_memory()
+        timer = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - timer
+            end, peak = tracemalloc.get_traced_memory()
+            top = [(str(stat.traceback[0]), stat.size_diff, stat.count_diff)
+                   for stat in self._snapshot().compare_to(before, 'lineno')
+                   if stat.size_diff > 0][:self.top]
+            if started:
+                tracemalloc.stop()
+            self.phases.append(
+                PhaseStats(name, max(peak - start, 0), end - start, top,
+                           elapsed))
+
+    def report(self):
+        """
+        Returns the text report of the profiled phases.
+        """
+        lines = []
+        for stats in self.phases:
+            lines.append('%s: peak %s, retained %s, %.3fs' % (
+                stats.name, format_size(stats.peak),
+                format_size(stats.retained), stats.elapsed))
+            for site, size, count in stats.top:
+                lines.append('    %s: %s in %d blocks' % (
+                    site, format_size(size), count))
+
+        return '\n'.join(lines)
+
+
+@contextmanager
+def profile_phase(profiler, name):
+    """
+    Profiles a ``with`` block as phase ``name`` of ``profiler``, does nothing
+    when ``profiler`` is ``None``.
+    """
+    if profiler is None:
+        yield
+    else:
+        with profiler.phase(name):
+            yield
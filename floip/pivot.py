@@ -0,0 +1,267 @@
+# -*- coding=utf-8 -*-
+"""
+Pivot of long-format Flow Results rows into one wide record per session.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+from collections import OrderedDict
+
+import six
+
+from floip import SESSION_COLUMNS, question_pairs
+
+WINDOW = 10000
+
+SPILL_BATCH_SIZE = 1000
+
+
+def session_key(session_id):
+    """
+    Returns the sort key of a session id in SQLite order: ``None`` first, then
+    numbers and then text.
+    """
+    if session_id is None:
+        return (0, 0)
+    if isinstance(session_id, six.string_types):
+        return (2, session_id)
+
+    return (1, session_id)
+
+
+def _merge(session, contact_id, timestamp, responses):
+    if session['contact_id'] is None:
+        session['contact_id'] = contact_id
+    if session['timestamp'] is None or \
+            (timestamp is not None and timestamp > session['timestamp']):
+        session['timestamp'] = timestamp
+    session['responses'].update(responses)
+
+
+class _SpillFile(object):
+    """
+    Temporary SQLite file of the sessions spilled by a ``SessionPivot``,
+    created in ``tmpdir`` on the first write. Spilled sessions are looked up
+    in an index on ``session_id`` behind a cache of at most ``cache_size``
+    ids, so memory does not grow with the number of sessions.
+    """
+
+    def __init__(self, tmpdir=None, cache_size=WINDOW):
+        self.tmpdir = tmpdir
+        self.cache_size = cache_size
+        self._path = None
+        self._connection = None
+        self._cache = OrderedDict()
+        self._pending = []
+        self._pending_sessions = set()
+
+    def _cache_session(self, session_id):
+        self._cache.pop(session_id, None)
+        self._cache[session_id] = True
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def write(self, session_id, seq, session):
+        """
+        Spills a partial session, ``seq`` orders the partials of a session.
+        """
+        if self._connection is None:
+            handle, self._path = tempfile.mkstemp(suffix='.sqlite',
+                                                  dir=self.tmpdir)
+            os.close(handle)
+            self._connection = sqlite3.connect(self._path)
+            self._connection.execute(
+                'CREATE TABLE spill (session_id, seq INTEGER, contact_id, '
+                'timestamp, responses TEXT)')
+            self._connection.execute(
+                'CREATE INDEX spill_session_id ON spill (session_id, seq)')
+        self._cache_session(session_id)
+        self._pending_sessions.add(session_id)
+        self._pending.append(
+            (session_id, seq, session['contact_id'], session['timestamp'],
+             json.dumps(session['responses'])))
+        if len(self._pending) >= SPILL_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            with self._connection:
+                self._connection.executemany(
+                    'INSERT INTO spill VALUES (?, ?, ?, ?, ?)', self._pending)
+            self._pending = []
+            self._pending_sessions = set()
+
+    def __contains__(self, session_id):
+        if self._connection is None:
+            return False
+        if session_id in self._cache or session_id in self._pending_sessions:
+            return True
+        spilled = self._connection.execute(
+            'SELECT 1 FROM spill WHERE session_id = ? LIMIT 1',
+            (session_id, )).fetchone() is not None
+        if spilled:
+            self._cache_session(session_id)
+
+        return spilled
+
+    def sessions(self):
+        """
+        Returns an iterator of the ``(session_id, session)`` pairs of the
+        spilled sessions merged by ``session_id``, in ``session_id`` order.
+        """
+        if self._connection is None:
+            return
+        self._flush()
+        cursor = self._connection.execute(
+            'SELECT session_id, contact_id, timestamp, responses FROM spill '
+            'ORDER BY session_id, seq')
+        current_id = session = None
+        for session_id, contact_id, timestamp, responses in cursor:
+            if session_id != current_id:
+                if session is not None:
+                    yield current_id, session
+                current_id = session_id
+                session = {
+                    'contact_id': None,
+                    'timestamp': None,
+                    'responses': {}
+                }
+            _merge(session, contact_id, timestamp, json.loads(responses))
+        if session is not None:
+            yield current_id, session
+
+    def close(self):
+        """
+        Closes and removes the spill file.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            os.remove(self._path)
+            self._connection = None
+        self._cache = OrderedDict()
+        self._pending = []
+        self._pending_sessions = set()
+
+
+class SessionPivot(object):
+    """
+    Pivots Flow Results rows into wide records, lists of the values of
+    ``columns``: ``session_id``, ``contact_id``, the latest ``timestamp`` and
+    the response to each question in the descriptor's ``questions`` order.
+
+    At most ``window`` sessions are kept in memory. When the window is full the
+    least recently seen session is spilled to a temporary SQLite file in
+    ``tmpdir``, and rows of spilled sessions go straight to the spill file.
+    In-memory sessions are emitted at the end of the input followed by the
+    spilled sessions merged by ``session_id``, so each session gives exactly
+    one record whatever the order of the input.
+
+    With ``ordered=True`` the caller guarantees that all rows of a session
+    arrive before it leaves the window, evicted sessions are then emitted
+    immediately and nothing is spilled.
+
+    questions - the questions, see ``floip.question_pairs``
+    """
+
+    def __init__(self, questions, window=WINDOW, ordered=False, tmpdir=None):
+        questions = question_pairs(questions)
+        self.questions = [name for name, _question in questions]
+        self.types = {
+            name: question.get('type')
+            for name, question in questions
+        }
+        self.window = window
+        self.ordered = ordered
+        self.tmpdir = tmpdir
+        self.spilled = 0
+        self._spill = None
+
+    @property
+    def columns(self):
+        """
+        Returns the names of the values of a record.
+        """
+        return list(SESSION_COLUMNS) + self.questions
+
+    def _record(self, session_id, session):
+        responses = session['responses']
+        return [session_id, session['contact_id'], session['timestamp']] + \
+            [responses.get(name) for name in self.questions]
+
+    def _spill_write(self, session_id, session):
+        self._spill.write(session_id, self.spilled, session)
+        self.spilled += 1
+
+    def pivot(self, rows, sort=False):
+        """
+        Returns an iterator of the wide records of an iterable of rows. With
+        ``sort=True`` every session is spilled and the records are emitted in
+        ``session_key`` order of their ``session_id``.
+        """
+        sessions = OrderedDict()
+        self._spill = _SpillFile(self.tmpdir, self.window)
+        try:
+            for row in rows:
+                timestamp, _row_id, contact_id, session_id, question_id, \
+                    response = row[:6]
+                partial = {
+                    'contact_id': contact_id,
+                    'timestamp': timestamp,
+                    'responses': {question_id: response}
+                }
+                session = sessions.pop(session_id, None)
+                if session is None:
+                    if session_id in self._spill:
+                        self._spill_write(session_id, partial)
+                        continue
+                    session = partial
+                else:
+                    _merge(session, contact_id, timestamp,
+                           partial['responses'])
+                sessions[session_id] = session
+                if len(sessions) > self.window:
+                    evicted_id, evicted = sessions.popitem(last=False)
+                    if self.ordered and not sort:
+                        yield self._record(evicted_id, evicted)
+                    else:
+                        self._spill_write(evicted_id, evicted)
+            for session_id, session in sessions.items():
+                if sort:
+                    self._spill_write(session_id, session)
+                else:
+                    yield self._record(session_id, session)
+            for session_id, session in self._spill.sessions():
+                yield self._record(session_id, session)
+        finally:
+            self._spill.close()
+
+    def submissions(self, rows, sort=False):
+        """
+        Returns an iterator of form submission dicts, keyed by question name
+        like the submissions ``floip.export`` reads, of an iterable of rows,
+        sorted by session with ``sort=True``.
+        """
+        for record in self.pivot(rows, sort):
+            session_id, contact_id, timestamp = record[:3]
+            submission = {
+                '_submission_time': timestamp,
+                'meta/contactID': contact_id,
+                'meta/sessionID': session_id
+            }
+            for name, response in zip(self.questions, record[3:]):
+                if response is None:
+                    continue
+                if self.types[name] == 'select_many' and \
+                        isinstance(response, list):
+                    response = ' '.join(response)
+                submission[name] = response
+            yield submission
+
+
+def pivot_rows(rows, questions, window=WINDOW, ordered=False, tmpdir=None):
+    """
+    Returns an iterator of one wide record per session of Flow Results rows,
+    see ``SessionPivot``.
+    """
+    return SessionPivot(questions, window, ordered, tmpdir).pivot(rows)
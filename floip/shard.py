@@ -0,0 +1,420 @@
+# -*- coding=utf-8 -*-
+"""
+Sharded, resumable conversion of Flow Results data resources.
+
+A data file written by ``floip.data.write_rows`` has one row per line, so it
+can be split into byte ranges on line boundaries and each range converted on
+its own, in separate processes or on separate machines sharing the work
+directory. Data files with any other layout are rejected. Sessions are not
+contiguous in data ordered by time, so the submissions of each shard are
+sorted by session and the submissions of a session spanning several shards
+are merged when the shards are.
+"""
+import codecs
+import heapq
+import io
+import json
+import multiprocessing
+import os
+import time
+
+import six
+
+from floip import load_descriptor, schema_questions
+from floip.batch import BatchResult
+from floip.data import (FIELDS, descriptor_base_path, open_data,
+                        resource_data_path)
+from floip.pivot import SessionPivot, session_key
+from floip.utils import makedirs, write_json
+
+JOB_FILE = 'job.json'
+
+_MISSING = object()
+
+
+LAYOUT_ERROR = ('%s does not have one row per line, rewrite it with '
+                'floip.data.write_data to shard it.')
+
+
+def _parse_line(line, path):
+    """
+    Returns the row of a data file line, ``None`` for the lines opening and
+    closing the JSON array. Raises a ``ValueError`` when the line is not a
+    row.
+    """
+    line = line.strip().rstrip(b',')
+    if not line or line in (b'[', b']'):
+        return None
+    try:
+        row = json.loads(line.decode('utf-8'))
+    except ValueError:
+        raise ValueError(LAYOUT_ERROR % path)
+    if not isinstance(row, list) or len(row) != len(FIELDS):
+        raise ValueError(LAYOUT_ERROR % path)
+
+    return row
+
+
+def check_layout(path, lines=100):
+    """
+    Raises a ``ValueError`` unless a data file is a JSON array with one row
+    per line as written by ``floip.data.write_rows``, checking its first
+    ``lines`` lines. Each shard checks every line of its range.
+    """
+    with io.open(path, 'rb') as data_file:
+        if data_file.readline().strip() != b'[':
+            raise ValueError(LAYOUT_ERROR % path)
+        for _index, line in zip(range(lines), data_file):
+            if line.strip() == b'[':
+                raise ValueError(LAYOUT_ERROR % path)
+            _parse_line(line, path)
+
+
+def shard_ranges(path, shards, sessions=False):
+    """
+    Returns up to ``shards`` ``(start, end)`` byte ranges of about the same
+    size covering a data file, each starting at the beginning of a line.
+
+    With ``sessions=True`` a range never ends within a run of rows of the same
+    ``session_id``, so all rows of a session are in one range when the rows
+    of each session are contiguous in the file.
+    """
+    check_layout(path)
+    size = os.path.getsize(path)
+    offsets = [0]
+    with io.open(path, 'rb') as data_file:
+        for index in range(1, shards):
+            offset = size * index // shards
+            if offset <= offsets[-1]:
+                data_file.seek(offsets[-1])
+            else:
+                data_file.seek(offset)
+                data_file.readline()
+            position = data_file.tell()
+            if sessions:
+                session_id = _MISSING
+                for line in iter(data_file.readline, b''):
+                    row = _parse_line(line, path)
+                    if row is not None:
+                        if session_id is _MISSING:
+                            session_id = row[3]
+                        elif row[3] != session_id:
+                            break
+                    position += len(line)
+            if offsets[-1] < position < size:
+                offsets.append(position)
+    offsets.append(size)
+
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def iter_shard_rows(path, start, end):
+    """
+    Returns an iterator of the rows of a data file in the ``[start, end)`` byte
+    range, raises a ``ValueError`` for a line that is not a row.
+    """
+    with io.open(path, 'rb') as data_file:
+        data_file.seek(start)
+        position = start
+        while position < end:
+            line = data_file.readline()
+            if not line:
+                break
+            if position and line.strip() == b'[':
+                raise ValueError(LAYOUT_ERROR % path)
+            position += len(line)
+            row = _parse_line(line, path)
+            if row is not None:
+                yield row
+
+
+def _output_path(work_dir, index):
+    return os.path.join(work_dir, 'shard-%05d.jsonl' % index)
+
+
+def _progress_path(work_dir, index):
+    return os.path.join(work_dir, 'shard-%05d.json' % index)
+
+
+class SubmissionConverter(object):
+    """
+    Picklable shard conversion callable, converts the rows of a shard to form
+    submissions with ``SessionPivot.submissions`` sorted by session.
+    """
+
+    def __init__(self, questions):
+        self.questions = [{name: question} for name, question in questions]
+
+    def __call__(self, rows):
+        return SessionPivot(self.questions).submissions(rows, sort=True)
+
+    @staticmethod
+    def key(submission):
+        """
+        Returns the sort key of a submission, the ``session_key`` of its
+        session.
+        """
+        return session_key(submission['meta/sessionID'])
+
+    @staticmethod
+    def combine(submission, later):
+        """
+        Returns a submission merged with a submission of the same session from
+        a later shard.
+        """
+        merged = dict(submission)
+        merged.update(later)
+        if merged['meta/contactID'] is None:
+            merged['meta/contactID'] = submission['meta/contactID']
+        if later['_submission_time'] is None or (
+                submission['_submission_time'] is not None and
+                submission['_submission_time'] > later['_submission_time']):
+            merged['_submission_time'] = submission['_submission_time']
+
+        return merged
+
+
+def _dump_record(record):
+    return json.dumps(record, separators=(',', ':')).encode('ascii')
+
+
+def _keyed_records(shard_file, index, key):
+    """
+    Returns an iterator of the ``(key, index, record)`` of the records of a
+    shard output, raises a ``ValueError`` when they are not sorted by key.
+    """
+    previous = None
+    for line in shard_file:
+        record = json.loads(line.decode('utf-8'))
+        record_key = key(record)
+        if previous is not None and record_key < previous:
+            raise ValueError('Records of shard %d are not sorted.' % index)
+        previous = record_key
+        yield record_key, index, record
+
+
+class _ShardRunner(object):  # pylint: disable=too-few-public-methods
+    """
+    Picklable per-shard conversion callable shared by the worker processes.
+    """
+
+    def __init__(self, path, work_dir, converter):
+        self.path = path
+        self.work_dir = work_dir
+        self.converter = converter
+
+    def __call__(self, shard):
+        index, start, end = shard
+        started = time.time()
+        try:
+            output_path = _output_path(self.work_dir, index)
+            records = 0
+            with io.open(output_path + '.tmp', 'wb') as output_file:
+                for record in self.converter(
+                        iter_shard_rows(self.path, start, end)):
+                    output_file.write(_dump_record(record) + b'\n')
+                    records += 1
+            getattr(os, 'replace', os.rename)(output_path + '.tmp',
+                                              output_path)
+            progress = {
+                'start': start,
+                'end': end,
+                'records': records,
+                'elapsed': time.time() - started
+            }
+            write_json(_progress_path(self.work_dir, index), progress)
+        except Exception as error:  # pylint: disable=broad-except
+            return index, None, '%s: %s' % (type(error).__name__, error)
+
+        return index, progress, None
+
+
+class ShardJob(object):
+    """
+    Converts the data resource of a FLOIP descriptor in byte-range shards.
+
+    The shard ranges are planned once and kept in ``job.json`` in
+    ``work_dir``. Each shard writes its records, one JSON line per record, and
+    then a progress file; shards with a progress file are done and are not
+    converted again, so a failed or interrupted job is resumed by running it
+    again. ``merge`` concatenates the shard outputs in shard order.
+
+    converter - picklable callable converting an iterable of rows to an
+                iterable of JSON records, defaults to a
+                ``SubmissionConverter``. When it has ``key`` and ``combine``
+                methods each shard's records must be sorted by ``key``, and
+                ``merge`` merges them across shards in key order, combining
+                the records with the same key.
+    sessions  - keep runs of rows of the same session in one shard
+    base_path - directory the data resource path is relative to, defaults to
+                the directory of a descriptor file
+    """
+
+    def __init__(self, descriptor, work_dir, shards=None, base_path=None,
+                 sessions=True, converter=None):
+        # The planning options of the job are keyword options.
+        # pylint: disable=too-many-arguments
+        base_path = descriptor_base_path(descriptor, base_path)
+        descriptor = getattr(descriptor, 'descriptor', None) or \
+            load_descriptor(descriptor)
+        self.path, compression = resource_data_path(descriptor, base_path)
+        if compression is not None:
+            raise ValueError('Compressed data files can not be sharded.')
+        self.work_dir = work_dir
+        self.converter = converter or \
+            SubmissionConverter(schema_questions(descriptor))
+        makedirs(work_dir)
+        self.plan = self._load_plan(shards or multiprocessing.cpu_count(),
+                                    sessions)
+
+    def _load_plan(self, shards, sessions):
+        stat = os.stat(self.path)
+        job_path = os.path.join(self.work_dir, JOB_FILE)
+        if os.path.exists(job_path):
+            with codecs.open(job_path, encoding='utf-8') as job_file:
+                plan = json.load(job_file)
+            if (plan['size'], plan['mtime']) != (stat.st_size, stat.st_mtime):
+                raise ValueError('%s changed since the job was planned.' %
+                                 self.path)
+            return plan
+        plan = {
+            'path': os.path.abspath(self.path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sessions': sessions,
+            'shards': shard_ranges(self.path, shards, sessions)
+        }
+        write_json(job_path, plan)
+
+        return plan
+
+    @property
+    def shards(self):
+        """
+        Returns the ``(start, end)`` byte ranges of the shards.
+        """
+        return [tuple(shard) for shard in self.plan['shards']]
+
+    def output_path(self, index):
+        """
+        Returns the path of the records of a shard.
+        """
+        return _output_path(self.work_dir, index)
+
+    def progress_path(self, index):
+        """
+        Returns the path of the progress file of a shard.
+        """
+        return _progress_path(self.work_dir, index)
+
+    def progress(self, index):
+        """
+        Returns the progress dict of a done shard, ``None`` otherwise.
+        """
+        path = self.progress_path(index)
+        if not os.path.exists(path):
+            return None
+        with codecs.open(path, encoding='utf-8') as progress_file:
+            progress = json.load(progress_file)
+        if (progress['start'], progress['end']) != self.shards[index]:
+            return None
+
+        return progress
+
+    def pending(self):
+        """
+        Returns the indexes of the shards that are not done.
+        """
+        return [
+            index for index in range(len(self.shards))
+            if self.progress(index) is None
+        ]
+
+    def run(self, indexes=None, workers=None):
+        """
+        Converts the pending shards, or the pending shards of ``indexes`` when
+        shards are shared out to several machines. ``workers`` is the number
+        of processes, defaults to the CPU count, ``1`` converts in the current
+        process.
+
+        Returns a ``BatchResult`` of ``(index, progress)`` pairs; a failing
+        shard does not stop the others.
+        """
+        pending = self.pending()
+        if indexes is not None:
+            indexes = set(indexes)
+            pending = [index for index in pending if index in indexes]
+        shards = [(index, ) + self.shards[index] for index in pending]
+        runner = _ShardRunner(self.path, self.work_dir, self.converter)
+        result = BatchResult()
+        workers = min(workers or multiprocessing.cpu_count(),
+                      len(shards) or 1)
+        if workers == 1:
+            outcomes = six.moves.map(runner, shards)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(workers)
+            outcomes = pool.imap_unordered(runner, shards)
+        try:
+            for index, progress, error in outcomes:
+                if error:
+                    result.failures.append((index, error))
+                else:
+                    result.converted.append((index, progress))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        result.finished = time.time()
+
+        return result
+
+    def _merged_records(self, shard_files):
+        key = getattr(self.converter, 'key', None)
+        combine = getattr(self.converter, 'combine', None)
+        if key is None or combine is None:
+            for shard_file in shard_files:
+                for line in shard_file:
+                    yield line.rstrip(b'\n')
+            return
+        current_key = current = None
+        for record_key, _index, record in heapq.merge(*[
+                _keyed_records(shard_file, index, key)
+                for index, shard_file in enumerate(shard_files)]):
+            if current is not None and record_key == current_key:
+                current = combine(current, record)
+                continue
+            if current is not None:
+                yield _dump_record(current)
+            current_key, current = record_key, record
+        if current is not None:
+            yield _dump_record(current)
+
+    def merge(self, path, compression=None):
+        """
+        Writes the records of all shards to a, possibly compressed, JSON array
+        file, returns the number of records written. The records are merged
+        by the converter's ``key``, or concatenated in shard order when it
+        has none.
+        """
+        pending = self.pending()
+        if pending:
+            raise ValueError('Shards %s are not done.' %
+                             ', '.join(str(index) for index in pending))
+        shard_files = [
+            io.open(self.output_path(index), 'rb')
+            for index in range(len(self.shards))
+        ]
+        count = 0
+        try:
+            with open_data(path, 'wb', compression) as output_file:
+                output_file.write(b'[')
+                for record in self._merged_records(shard_files):
+                    output_file.write((b',\n' if count else b'\n') + record)
+                    count += 1
+                output_file.write(b'\n]\n')
+        finally:
+            for shard_file in shard_files:
+                shard_file.close()
+
+        return count
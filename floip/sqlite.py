@@ -0,0 +1,176 @@
+# -*- coding=utf-8 -*-
+"""
+Bulk loading of Flow Results data into SQLite.
+"""
+import json
+import sqlite3
+import time
+
+from floip import (SESSION_COLUMNS, ValidationError, load_descriptor,
+                   schema_questions)
+from floip.data import descriptor_base_path, read_resource
+
+BATCH_SIZE = 50000
+
+# SQLite column types of FLOIP question types, other types are TEXT.
+SQLITE_TYPES = {'numeric': 'NUMERIC'}
+
+
+def quote(name):
+    """
+    Returns a quoted SQLite identifier.
+    """
+    return '"%s"' % name.replace('"', '""')
+
+
+def _column_key(name):
+    # SQLite column names are case-insensitive for ASCII letters only.
+    return ''.join(char.lower() if char < u'\x80' else char for char in name)
+
+
+def _value(response):
+    if isinstance(response, (dict, list)):
+        return json.dumps(response)
+    return response
+
+
+class SQLiteLoader(object):
+    """
+    Loads Flow Results rows into a SQLite table with one record per session
+    and one typed column per question of the descriptor's
+    ``schema.questions``.
+
+    Rows are merged into session records in memory ``batch_size`` rows at a
+    time and each batch is written in one transaction with ``executemany``.
+
+    database - a ``sqlite3.Connection`` or a database path
+    table    - table name, defaults to the descriptor ``name``
+    """
+
+    def __init__(self, database, descriptor, table=None,
+                 batch_size=BATCH_SIZE):
+        if not isinstance(database, sqlite3.Connection):
+            database = sqlite3.connect(database)
+        self.connection = database
+        descriptor = getattr(descriptor, 'descriptor', None) or \
+            load_descriptor(descriptor)
+        self.table = table or descriptor['name']
+        self.questions = schema_questions(descriptor)
+        columns = set(_column_key(column) for column in SESSION_COLUMNS)
+        clashes = []
+        for name, _question in self.questions:
+            if _column_key(name) in columns:
+                clashes.append(name)
+            columns.add(_column_key(name))
+        if clashes:
+            raise ValidationError(
+                'Question names %s clash with the session columns or other '
+                'questions, SQLite column names are case-insensitive.' %
+                ', '.join(clashes))
+        self.batch_size = batch_size
+        self.rows = 0
+        self.skipped = 0
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        """
+        Returns the number of rows loaded per second.
+        """
+        return self.rows / self.elapsed if self.elapsed else float(self.rows)
+
+    def create_table(self):
+        """
+        Creates the flow table and its contact index if they do not exist.
+        """
+        columns = [
+            'session_id TEXT PRIMARY KEY', 'contact_id TEXT', 'timestamp TEXT'
+        ] + [
+            '%s %s' % (quote(name), SQLITE_TYPES.get(question['type'], 'TEXT'))
+            for name, question in self.questions
+        ]
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (
+                quote(self.table), ', '.join(columns)))
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS %s ON %s (contact_id)' %
+                (quote(self.table + '_contact_id'), quote(self.table)))
+
+    def _write(self, sessions):
+        table = quote(self.table)
+        columns = {}
+        for session_id, session in sessions.items():
+            for name, response in session['responses'].items():
+                columns.setdefault(name, []).append((response, session_id))
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO %s (%s) VALUES (?, ?, ?)' %
+                (table, ', '.join(SESSION_COLUMNS)),
+                [(session_id, session['contact_id'], session['timestamp'])
+                 for session_id, session in sessions.items()])
+            self.connection.executemany(
+                'UPDATE %s SET timestamp = ? WHERE session_id = ? AND '
+                '(timestamp IS NULL OR timestamp < ?)' % table,
+                [(session['timestamp'], session_id, session['timestamp'])
+                 for session_id, session in sessions.items()])
+            for name, values in columns.items():
+                self.connection.executemany(
+                    'UPDATE %s SET %s = ? WHERE session_id = ?' %
+                    (table, quote(name)), values)
+
+    def load(self, rows):
+        """
+        Loads an iterable of Flow Results rows, returns the number of rows
+        loaded. Rows for questions not in the descriptor are skipped.
+        """
+        started = time.time()
+        questions = dict(self.questions)
+        self.create_table()
+        loaded = 0
+        sessions = {}
+        batch = 0
+        for row in rows:
+            timestamp, _row_id, contact_id, session_id, question_id, \
+                response = row[:6]
+            if question_id not in questions:
+                self.skipped += 1
+                continue
+            session = sessions.get(session_id)
+            if session is None:
+                session = sessions[session_id] = {
+                    'contact_id': contact_id,
+                    'timestamp': timestamp,
+                    'responses': {}
+                }
+            elif timestamp > session['timestamp']:
+                session['timestamp'] = timestamp
+            session['responses'][question_id] = _value(response)
+            batch += 1
+            if batch >= self.batch_size:
+                self._write(sessions)
+                loaded += batch
+                sessions = {}
+                batch = 0
+        if sessions:
+            self._write(sessions)
+            loaded += batch
+        self.rows += loaded
+        self.elapsed += time.time() - started
+
+        return loaded
+
+
+def load_package(descriptor, database, base_path=None, table=None,
+                 batch_size=BATCH_SIZE):
+    """
+    Loads the data resource of a FLOIP descriptor into a SQLite database,
+    returns the ``SQLiteLoader`` used. ``base_path`` defaults to the
+    directory of a descriptor file.
+    """
+    base_path = descriptor_base_path(descriptor, base_path)
+    descriptor = getattr(descriptor, 'descriptor', None) or \
+        load_descriptor(descriptor)
+    loader = SQLiteLoader(database, descriptor, table, batch_size)
+    loader.load(read_resource(descriptor, base_path))
+
+    return loader
@@ -0,0 +1,107 @@
+# -*- coding=utf-8 -*-
+"""
+Test bulk XForm to FLOIP descriptor conversion.
+"""
+import json
+import os
+import uuid
+
+from click.testing import CliRunner
+
+from floip import FloipSurvey
+from floip.batch import convert_surveys, stable_flow_id
+from floip.cli import cli
+
+
+def test_stable_flow_id():
+    """
+    Test stable_flow_id() returns the same version 4 UUID for an id_string.
+    """
+    flow_id = stable_flow_id('flow-results-example-1')
+    assert flow_id == stable_flow_id('flow-results-example-1')
+    assert flow_id != stable_flow_id('flow-results-example-2')
+    assert uuid.UUID(flow_id).version == 4
+
+
+def test_convert_surveys(tmpdir):
+    """
+    Test convert_surveys() writes descriptors and reports failures.
+    """
+    survey = FloipSurvey('data/flow-results-example-1.json')
+    bad_file = tmpdir.join('bad.json')
+    bad_file.write('{bad')
+    flow_id = survey.descriptor['id']
+    output_dir = str(tmpdir.join('out'))
+    result = convert_surveys(
+        [survey.survey_dict(), str(bad_file)], output_dir,
+        created=survey.descriptor['created'],
+        modified=survey.descriptor['modified'],
+        flow_ids={'flow-results-example-1': flow_id}, workers=1,
+        validate=True)
+
+    assert result.total == 2
+    assert len(result.converted) == 1
+    assert result.failures[0][0] == str(bad_file)
+    assert result.throughput > 0
+    path = os.path.join(output_dir, 'flow-results-example-1.json')
+    assert result.converted[0] == ('flow-results-example-1', path)
+    with open(path) as descriptor_file:
+        descriptor = json.load(descriptor_file)
+    assert descriptor['id'] == flow_id
+    assert descriptor['resources'][0]['schema']['questions'] == \
+        survey.descriptor['resources'][0]['schema']['questions']
+
+
+def test_batch_command(tmpdir):
+    """
+    Test the floip batch command with worker processes.
+    """
+    survey = FloipSurvey('data/flow-results-example-1.json')
+    survey_file = tmpdir.join('survey.json')
+    survey_file.write(json.dumps(survey.survey_dict()))
+    output_dir = str(tmpdir.join('out'))
+    result = CliRunner().invoke(
+        cli, ['batch', output_dir, str(survey_file), '--workers', '2'])
+
+    assert result.exit_code == 0
+    assert result.output.startswith('1 converted, 0 failed')
+    assert os.listdir(output_dir) == ['flow-results-example-1.json']
+
+
+def test_convert_surveys_duplicate_id_string(tmpdir):  # pylint: disable=C0103
+    """
+    Test convert_surveys() fails forms with an id_string already converted
+    instead of overwriting its descriptor.
+    """
+    survey = FloipSurvey('data/flow-results-example-1.json').survey_dict()
+    other = dict(survey, title='Another form')
+    output_dir = str(tmpdir.join('out'))
+    result = convert_surveys([survey, other], output_dir, workers=1)
+
+    assert len(result.converted) == 1
+    assert result.failures == [(
+        'flow-results-example-1',
+        "Duplicate id_string 'flow-results-example-1', also in "
+        "flow-results-example-1")]
+    assert os.listdir(output_dir) == ['flow-results-example-1.json']
+    with open(result.converted[0][1]) as descriptor_file:
+        assert json.load(descriptor_file)['title'] == survey['title']
+
+
+def test_convert_surveys_invalid_id_string(tmpdir):  # pylint: disable=C0103
+    """
+    Test convert_surveys() fails forms whose id_string is not a file name and
+    descriptors that can not be renamed, leaving no temporary files.
+    """
+    survey = FloipSurvey('data/flow-results-example-1.json').survey_dict()
+    output_dir = tmpdir.join('out')
+    output_dir.join('flow-results-example-1.json').ensure(dir=True)
+    surveys = [dict(survey, id_string=id_string)
+               for id_string in ('../escaped', 'a/b', '.hidden')] + [survey]
+    result = convert_surveys(surveys, str(output_dir), workers=1)
+
+    assert result.converted == []
+    assert [error.startswith('ValueError: Invalid id_string')
+            for _name, error in result.failures] == [True, True, True, False]
+    assert os.listdir(str(output_dir)) == ['flow-results-example-1.json']
+    assert not tmpdir.join('escaped.json').exists()
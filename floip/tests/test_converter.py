@@ -0,0 +1,85 @@
+# -*- coding=utf-8 -*-
+"""
+Test the thread-safe FloipConverter.
+"""
+import codecs
+import json
+import time
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from floip.converter import FloipConverter
+
+
+def _descriptor(index):
+    with codecs.open('data/flow-results-example-1.json') as descriptor_file:
+        descriptor = json.load(descriptor_file)
+    descriptor['title'] = 'Flow %d' % index
+
+    return descriptor
+
+
+def test_converter_cache():
+    """
+    Test FloipConverter.xml() caches XForms by descriptor content.
+    """
+    converter = FloipConverter(validate=False, cache_size=1)
+    with codecs.open('data/flow-results-example-1.xml') as xform_file:
+        expected = xform_file.read()
+    descriptor = _descriptor(1)
+    descriptor['title'] = 'A nice title'
+
+    assert converter.xml(descriptor) == expected
+    assert converter.xml('data/flow-results-example-1.json') == expected
+    assert (converter.hits, converter.misses) == (1, 1)
+
+    converter.xml(_descriptor(2))
+    converter.xml(descriptor)
+    assert (converter.hits, converter.misses) == (1, 3)
+
+
+def test_converter_threads():
+    """
+    Stress test a shared FloipConverter from thread pools of increasing size,
+    every thread count must give the same XForms as a single thread.
+    """
+    descriptors = [_descriptor(index) for index in range(16)]
+    expected = [
+        FloipConverter(validate=False, cache_size=0).xml(descriptor)
+        for descriptor in descriptors
+    ]
+    for threads in (1, 2, 4, 8):
+        converter = FloipConverter(validate=False, cache_size=0)
+        pool = ThreadPool(threads)
+        try:
+            results = pool.map(converter.xml, descriptors)
+        finally:
+            pool.close()
+            pool.join()
+        assert results == expected
+        assert converter.misses == len(descriptors)
+
+
+@pytest.mark.benchmark
+def test_converter_throughput(capsys):
+    """
+    Benchmark a shared FloipConverter, reports the XForms converted per second
+    by thread pool size without asserting on timings.
+    """
+    descriptors = [_descriptor(index) for index in range(16)]
+    throughput = []
+    for threads in (1, 2, 4, 8):
+        converter = FloipConverter(validate=False, cache_size=0)
+        pool = ThreadPool(threads)
+        started = time.time()
+        try:
+            pool.map(converter.xml, descriptors)
+        finally:
+            pool.close()
+            pool.join()
+        throughput.append('%d: %.1f' % (
+            threads, len(descriptors) / (time.time() - started)))
+
+    with capsys.disabled():
+        print('\nXForms/s by thread count: %s' % ', '.join(throughput))
@@ -0,0 +1,108 @@
+# -*- coding=utf-8 -*-
+"""
+Test reading and writing Flow Results data resources.
+"""
+import io
+import json
+
+import pytest
+
+from floip import FloipSurvey, survey_to_floip_package
+from floip.data import (data_compression, iter_rows, read_data,
+                        read_resource, write_data)
+
+ROWS = [
+    ['2017-05-23T12:35:37.1+00:00', 20394823948, 923842093, 10499221,
+     'ae54d1', 'female', {'option_order': ['male', 'female']}],
+    ['2017-05-23T12:35:39.1+00:00', 20394823950, 923842093, 10499221,
+     'ae54d7', u'Très bien', {}],
+    ['2017-05-23T12:35:40.1+00:00', 20394823951, 923842093, 10499221,
+     'ae54d3', 160, {}],
+]  # yapf: disable
+
+
+def test_data_compression():
+    """
+    Test data_compression() prefers the hint over the file extension.
+    """
+    assert data_compression('data.json') is None
+    assert data_compression('data.json.gz') == 'gzip'
+    assert data_compression('data.json.zst') == 'zstd'
+    assert data_compression('data.json', 'gz') == 'gzip'
+    with pytest.raises(ValueError):
+        data_compression('data.json', 'bz2')
+
+
+def test_iter_rows_in_chunks():
+    """
+    Test iter_rows() reads rows split across small chunks.
+    """
+    content = u' [ %s]' % u', '.join(
+        json.dumps(row, ensure_ascii=False) for row in ROWS)
+    data = io.BytesIO(content.encode('utf-8'))
+    assert list(iter_rows(data, chunk_size=3)) == ROWS
+
+    with pytest.raises(ValueError):
+        list(iter_rows(io.BytesIO(b'[["2017-05-23", 1'), chunk_size=3))
+
+
+@pytest.mark.parametrize('content', [
+    b'[,,[1]]', b'[[1] [2]]', b'[[1],,[2]]', b'[[1],]', b'[[1]', b'[1,',
+    b'{"rows": []}'
+])
+def test_iter_rows_malformed(content):
+    """
+    Test iter_rows() requires exactly one comma between rows.
+    """
+    with pytest.raises(ValueError):
+        list(iter_rows(io.BytesIO(content), chunk_size=2))
+
+
+def test_iter_rows_literals_across_chunks():  # pylint: disable=C0103
+    """
+    Test iter_rows() reads literals and strings split across chunks.
+    """
+    content = b'[[false, null, true, -Infinity, "\\u00e9"],\n[1.5e3]]'
+    for chunk_size in range(1, 8):
+        assert list(iter_rows(io.BytesIO(content), chunk_size)) == [
+            [False, None, True, float('-inf'), u'\u00e9'], [1500.0]]
+
+
+def test_iter_rows_fails_fast():
+    """
+    Test iter_rows() raises on malformed rows without reading to the end.
+    """
+    data = io.BytesIO(b'[[1], [2, }], ' + b'[3], ' * 100000 + b'[4]]')
+    with pytest.raises(ValueError):
+        list(iter_rows(data, chunk_size=64))
+    assert data.tell() <= 128
+
+
+@pytest.mark.parametrize('extension', ['', '.gz', '.zst', '.lz4'])
+def test_write_and_read_data(tmpdir, extension):
+    """
+    Test write_data() and read_data() with each compression.
+    """
+    if extension == '.zst':
+        pytest.importorskip('zstandard')
+    if extension == '.lz4':
+        pytest.importorskip('lz4.frame')
+    path = str(tmpdir.join('data.json' + extension))
+
+    assert write_data(path, iter(ROWS)) == 3
+    assert list(read_data(path, chunk_size=16)) == ROWS
+
+
+def test_read_resource(tmpdir):
+    """
+    Test read_resource() uses the resource compression hint.
+    """
+    survey = FloipSurvey('data/flow-results-example-1.json')
+    package = survey_to_floip_package(
+        survey.survey_dict(), survey.descriptor['id'],
+        survey.descriptor['created'], survey.descriptor['modified'],
+        'flow-results-example-1-data', compression='gzip')
+    write_data(str(tmpdir.join('flow-results-example-1-data')), ROWS, 'gzip')
+
+    assert package.valid is True
+    assert list(read_resource(package, str(tmpdir))) == ROWS
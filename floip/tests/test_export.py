@@ -0,0 +1,74 @@
+# -*- coding=utf-8 -*-
+"""
+Test incremental export of submissions to Flow Results.
+"""
+import json
+
+from floip import FloipSurvey
+from floip.data import read_data
+from floip.export import IncrementalExporter
+
+SUBMISSIONS = [{
+    '_id': 1,
+    '_submission_time': '2017-06-30T15:35:27',
+    'ae54d1': 'female',
+    'ae54d2': 'chocolate vanilla',
+    'meta/contactID': 'c1',
+    'meta/sessionID': 's1'
+}, {
+    '_id': 2,
+    '_submission_time': '2017-06-30T15:36:27',
+    'ae54d3': 160,
+    'meta/contactID': 'c2',
+    'meta/sessionID': 's2'
+}, {
+    '_id': 3,
+    '_submission_time': '2017-06-30T15:37:27',
+    'ae54d7': 'Good',
+    'meta/contactID': 'c1',
+    'meta/sessionID': 's3'
+}]  # yapf: disable
+
+
+def _exporter(tmpdir):
+    survey = FloipSurvey('data/flow-results-example-1.json')
+    return IncrementalExporter(survey.survey_dict(), survey.descriptor['id'],
+                               str(tmpdir.join('flow.json')))
+
+
+def test_incremental_export(tmpdir):
+    """
+    Test IncrementalExporter.export() only appends new submissions.
+    """
+    exporter = _exporter(tmpdir)
+    assert exporter.export(SUBMISSIONS[:2], '2017-07-01 00:00:00+00:00') == 3
+    assert exporter.high_water_mark == ('2017-06-30T15:36:27', 2)
+
+    exporter = _exporter(tmpdir)
+    assert exporter.export(SUBMISSIONS, '2017-07-02 00:00:00+00:00') == 1
+    assert exporter.export(SUBMISSIONS) == 0
+
+    rows = list(read_data(exporter.data_path))
+    assert [row[1] for row in rows] == ['1-ae54d1', '1-ae54d2', '2-ae54d3',
+                                        '3-ae54d7']
+    assert rows[1] == ['2017-06-30T15:35:27', '1-ae54d2', 'c1', 's1',
+                       'ae54d2', ['chocolate', 'vanilla'], {}]
+    with open(exporter.path) as descriptor_file:
+        descriptor = json.load(descriptor_file)
+    assert descriptor['modified'] == '2017-07-02 00:00:00+00:00'
+    assert descriptor['resources'][0]['path'] == 'flow-data.json'
+
+
+def test_export_resumes_after_crash(tmpdir):
+    """
+    Test rows written after the last checkpoint are discarded.
+    """
+    exporter = _exporter(tmpdir)
+    exporter.export(SUBMISSIONS[:1])
+    with open(exporter.data_path, 'ab') as data_file:
+        data_file.write(b',\n["2017-06-30T15:36:27","2-ae5')
+
+    exporter = _exporter(tmpdir)
+    assert exporter.export(SUBMISSIONS) == 2
+    assert [row[1] for row in read_data(exporter.data_path)] == [
+        '1-ae54d1', '1-ae54d2', '2-ae54d3', '3-ae54d7']
@@ -4,14 +4,17 @@ Test floip utility functions."
 """
 
 import codecs
+import copy
 import json
 import pytest
 
+from click.testing import CliRunner
 from pyxform import Survey
 
-from floip import (FloipSurvey, floip_dict_from_xform_dict,
+from floip import (FloipSurvey, canonical_xml, floip_dict_from_xform_dict,
                    survey_questions, survey_to_floip_package,
                    xform_from_floip_dict, ValidationError)
+from floip.cli import cli
 
 
 def test_geopoint_question_to_xform():
@@ -585,3 +588,80 @@ def test_floip_descriptor_to_xform_questions_as_list(): # pylint: disable=C0103
             'data/flow-results-example-1-data.json')
         assert package.descriptor == json.load(descriptor_file)
         assert package.valid is True
+
+
+def test_canonical_xml():
+    """
+    Test canonical_xml() sorts XML attributes.
+    """
+    survey = FloipSurvey('data/flow-results-example-1.json')
+    with codecs.open('data/flow-results-example-1.xml') as xform_file:
+        assert canonical_xml(survey.survey) == xform_file.read()
+
+
+def test_fingerprint():
+    """
+    Test FloipSurvey.fingerprint is the same for equal descriptors whatever
+    the question order and canonical flag, and changes when the XForm changes.
+    """
+    survey = FloipSurvey('data/flow-results-example-1.json')
+    with codecs.open('data/flow-results-example-2.json') as descriptor_file:
+        descriptor = json.load(descriptor_file)
+    descriptor['resources'][0]['schema']['questions'].reverse()
+    canonical_survey = FloipSurvey(json.dumps(descriptor), canonical=True)
+    assert canonical_survey.fingerprint == survey.fingerprint
+    assert len(survey.fingerprint) == 64
+
+    reversed_survey = FloipSurvey(json.dumps(descriptor))
+    assert reversed_survey.fingerprint == survey.fingerprint
+    assert reversed_survey.xml(validate=False) != \
+        canonical_survey.xml(validate=False)
+
+    descriptor['title'] = 'Another title'
+    changed_survey = FloipSurvey(json.dumps(descriptor), canonical=True)
+    assert changed_survey.fingerprint != survey.fingerprint
+
+
+def test_fingerprint_command():
+    """
+    Test floip --fingerprint outputs the survey fingerprint.
+    """
+    survey = FloipSurvey('data/flow-results-example-1.json')
+    result = CliRunner().invoke(
+        cli, ['data/flow-results-example-1.json', '--fingerprint'])
+
+    assert result.exit_code == 0
+    assert result.output == survey.fingerprint + '\n'
+
+
+def test_multi_language_labels():
+    """
+    Test FloipSurvey renders the XForm of each language of per-language
+    labels the same as a conversion of that language's labels.
+    """
+    with codecs.open('data/flow-results-example-1.json') as descriptor_file:
+        descriptor = json.load(descriptor_file)
+    schema = descriptor['resources'][0]['schema']
+    schema['language'] = 'fra'
+    for question in schema['questions'].values():
+        question['label'] = {
+            'eng': question['label'],
+            'fra': u'%s en français' % question['label'],
+            'swa': u'%s kwa Kiswahili' % question['label']
+        }
+    survey = FloipSurvey(copy.deepcopy(descriptor))
+    assert survey.languages == ['fra', 'eng', 'swa']
+    xml = survey.xml(validate=False)
+    assert '<translation lang="fra" default="true()">' in xml
+    assert '<translation lang="swa">' in xml
+
+    for language in survey.languages:
+        single = copy.deepcopy(descriptor)
+        single['resources'][0]['schema']['language'] = language
+        for question in \
+                single['resources'][0]['schema']['questions'].values():
+            question['label'] = question['label'][language]
+        assert survey.xml(validate=False, language=language) == \
+            FloipSurvey(single).xml(validate=False)
+    with pytest.raises(ValidationError):
+        survey.xml(validate=False, language='deu')
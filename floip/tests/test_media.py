@@ -0,0 +1,164 @@
+# -*- coding=utf-8 -*-
+"""
+Test attaching media files to submissions.
+"""
+import errno
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+from floip.media import MediaStage, file_digest
+from floip.pivot import SessionPivot
+
+QUESTIONS = {
+    'photo': {'type': 'image'},
+    'voice': {'type': 'audio'},
+    'name': {'type': 'text'},
+}  # yapf: disable
+
+
+def test_media_stage(tmpdir):
+    """
+    Test MediaStage.attach() stores each distinct file once.
+    """
+    media = tmpdir.mkdir('media')
+    media.join('a.jpg').write_binary(b'image')
+    media.join('b.jpg').write_binary(b'image')
+    media.join('c.ogg').write_binary(b'audio')
+    output_dir = str(tmpdir.join('attachments'))
+    stage = MediaStage(QUESTIONS, 'file://' + str(media), output_dir,
+                       workers=2)
+    submissions = [
+        {'photo': 'a.jpg', 'voice': 'c.ogg', 'name': 'Jane'},
+        {'photo': 'b.jpg', 'name': 'John'},
+        {'photo': 'file://' + str(media.join('a.jpg'))},
+        {'photo': 'missing.jpg'},
+    ]
+    attached = list(stage.attach(submissions, batch_size=2))
+
+    digest = file_digest(str(media.join('a.jpg')))
+    assert attached[0]['photo'] == attached[1]['photo'] == digest + '.jpg'
+    assert [attachment['question'] for attachment in
+            attached[0]['_attachments']] == ['photo', 'voice']
+    assert attached[0]['name'] == 'Jane'
+    assert attached[2]['_attachments'][0]['sha256'] == digest
+    assert attached[3] == {'photo': 'missing.jpg', '_attachments': []}
+    stats = stage.stats
+    assert stats.missing == [os.path.realpath(str(media.join('missing.jpg')))]
+    assert (stats.files, stats.stored, stats.deduplicated) == (4, 2, 2)
+    assert stats.bytes == 20
+    assert stats.files_per_second > 0
+    assert sorted(os.listdir(output_dir)) == sorted(
+        [digest + '.jpg', file_digest(str(media.join('c.ogg'))) + '.ogg'])
+
+
+def test_media_stage_outside_source(tmpdir):
+    """
+    Test MediaStage.attach() rejects responses resolving outside the source.
+    """
+    media = tmpdir.mkdir('media')
+    tmpdir.join('secret.jpg').write_binary(b'secret')
+    os.symlink(str(tmpdir.join('secret.jpg')), str(media.join('link.jpg')))
+    output_dir = str(tmpdir.join('attachments'))
+    stage = MediaStage(QUESTIONS, str(media), output_dir)
+    responses = [
+        '../secret.jpg',
+        str(tmpdir.join('secret.jpg')),
+        'file://' + str(tmpdir.join('secret.jpg')),
+        'link.jpg',
+    ]
+    attached = list(
+        stage.attach({'photo': response} for response in responses))
+
+    assert [submission['photo'] for submission in attached] == responses
+    assert stage.stats.rejected == responses
+    assert stage.stats.files == 0
+    assert os.listdir(output_dir) == []
+
+
+def test_media_stage_write_errors(tmpdir, monkeypatch):
+    """
+    Test MediaStage.attach() raises errors writing to the output directory.
+    """
+    tmpdir.join('a.jpg').write_binary(b'image')
+
+    def _copyfile(_source, _target):
+        raise IOError(errno.ENOSPC, 'No space left on device')
+
+    monkeypatch.setattr(shutil, 'copyfile', _copyfile)
+    stage = MediaStage(QUESTIONS, str(tmpdir), str(tmpdir.join('out')),
+                       link=False)
+    with pytest.raises(IOError):
+        list(stage.attach([{'photo': 'a.jpg'}]))
+    assert stage.stats.missing == []
+
+
+def test_media_stage_store_race(tmpdir, monkeypatch):
+    """
+    Test a thread storing a digest another thread failed to store stores it,
+    and a failed copy leaves no partial file behind.
+    """
+    tmpdir.join('a.jpg').write_binary(b'image')
+    tmpdir.join('b.jpg').write_binary(b'image')
+    copyfile = shutil.copyfile
+    calls = []
+
+    def _copyfile(source, target):
+        calls.append(source)
+        if len(calls) == 1:
+            with open(target, 'wb') as target_file:
+                target_file.write(b'ima')
+            time.sleep(0.1)
+            raise IOError(errno.ENOSPC, 'No space left on device')
+        return copyfile(source, target)
+
+    monkeypatch.setattr(shutil, 'copyfile', _copyfile)
+    stage = MediaStage(QUESTIONS, str(tmpdir), str(tmpdir.join('out')),
+                       link=False)
+    os.makedirs(stage.output_dir)
+    digest = file_digest(str(tmpdir.join('a.jpg')))
+    results = {}
+
+    def _store(name):
+        # pylint: disable=protected-access
+        try:
+            results[name] = stage._media_store.store(
+                str(tmpdir.join(name)), digest)
+        except IOError as error:
+            results[name] = error
+
+    threads = [threading.Thread(target=_store, args=(name, ))
+               for name in ('a.jpg', 'b.jpg')]
+    threads[0].start()
+    time.sleep(0.02)
+    threads[1].start()
+    for thread in threads:
+        thread.join()
+
+    assert isinstance(results['a.jpg'], IOError)
+    assert results['b.jpg'] == (digest + '.jpg', True)
+    assert os.listdir(stage.output_dir) == [digest + '.jpg']
+    assert file_digest(os.path.join(stage.output_dir, digest + '.jpg')) == \
+        digest
+
+
+def test_pivot_submissions(tmpdir):
+    """
+    Test media attached to submissions generated from Flow Results rows.
+    """
+    tmpdir.join('a.jpg').write_binary(b'image')
+    rows = [
+        ['2017-05-23T12:35:37', 1, 'c1', 's1', 'photo', 'a.jpg', {}],
+        ['2017-05-23T12:35:38', 2, 'c1', 's1', 'name', 'Jane', {}],
+    ]
+    submissions = SessionPivot(QUESTIONS).submissions(rows)
+    stage = MediaStage(QUESTIONS, str(tmpdir), str(tmpdir.join('out')),
+                       link=False)
+    submission = next(stage.attach(submissions))
+
+    assert submission['meta/sessionID'] == 's1'
+    assert submission['name'] == 'Jane'
+    assert submission['_attachments'][0]['filename'] == submission['photo']
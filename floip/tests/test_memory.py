@@ -0,0 +1,98 @@
+# -*- coding=utf-8 -*-
+"""
+Test memory profiling of FLOIP conversions.
+"""
+import codecs
+import gc
+import json
+
+from click.testing import CliRunner
+
+from floip import FloipSurvey
+from floip.cli import cli
+from floip.memory import MemoryProfiler, format_size
+
+PHASES = ['load', 'package', 'build', 'serialize']
+
+
+def _descriptor(count):
+    with codecs.open('data/flow-results-example-1.json') as descriptor_file:
+        descriptor = json.load(descriptor_file)
+    descriptor['resources'][0]['schema']['questions'] = {
+        'q%d' % i: {
+            'type': 'text',
+            'label': 'Question %d' % i,
+            'type_options': {}
+        }
+        for i in range(count)
+    }
+
+    return descriptor
+
+
+def _profile(count):
+    # garbage collection runs at different points of a phase from run to run,
+    # disable it so that peaks only depend on the number of questions.
+    gc.collect()
+    gc.disable()
+    try:
+        profiler = MemoryProfiler()
+        FloipSurvey(_descriptor(count), profiler=profiler).xml(validate=False)
+    finally:
+        gc.enable()
+
+    return profiler
+
+
+def test_memory_profiler():
+    """
+    Test FloipSurvey records the peak memory of each conversion phase.
+    """
+    profiler = _profile(10)
+
+    assert [stats.name for stats in profiler.phases] == PHASES
+    assert all(stats.peak > 0 for stats in profiler.phases)
+    assert profiler.peak == max(stats.peak for stats in profiler.phases)
+    assert profiler.phases[0].top
+    report = profiler.report()
+    assert report.startswith('load: peak ')
+    assert 'serialize: peak ' in report
+
+
+def test_peak_memory_scales_linearly():  # pylint: disable=C0103
+    """
+    Test the peak memory of each phase grows at most linearly with the number
+    of questions.
+    """
+    small = _profile(200)
+    large = _profile(800)
+
+    for small_stats, large_stats in zip(small.phases, large.phases):
+        assert large_stats.peak < 4 * 1.25 * small_stats.peak, \
+            large_stats.name
+    assert large.peak < 4 * 1.25 * small.peak
+
+
+def test_profile_memory_command():
+    """
+    Test floip --profile-memory reports phases without changing the output.
+    """
+    survey = FloipSurvey('data/flow-results-example-1.json')
+    result = CliRunner().invoke(cli, [
+        'data/flow-results-example-1.json', '--fingerprint',
+        '--profile-memory'
+    ])
+
+    assert result.exit_code == 0
+    assert result.output.startswith(survey.fingerprint + '\n')
+    assert 'build: peak ' in result.output
+    assert 'serialize: peak ' in result.output
+
+
+def test_format_size():
+    """
+    Test format_size() output.
+    """
+    assert format_size(512) == '512.0 B'
+    assert format_size(1536) == '1.5 KiB'
+    assert format_size(3 * 1024 ** 3) == '3.0 GiB'
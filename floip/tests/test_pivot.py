@@ -0,0 +1,96 @@
+# -*- coding=utf-8 -*-
+"""
+Test pivoting Flow Results rows into wide session records.
+"""
+import os
+
+from floip import load_descriptor
+from floip.pivot import SessionPivot, pivot_rows
+
+QUESTIONS = [{'q1': {'type': 'text'}}, {'q2': {'type': 'numeric'}}]
+
+ROWS = [
+    ['2017-05-23T12:35:37', 1, 'c1', 's1', 'q1', 'a', {}],
+    ['2017-05-23T12:35:38', 2, 'c2', 's2', 'q1', 'b', {}],
+    ['2017-05-23T12:35:39', 3, 'c3', 's3', 'q2', 3, {}],
+    ['2017-05-23T12:35:40', 4, 'c1', 's1', 'q2', 1, {}],
+    ['2017-05-23T12:35:41', 5, 'c4', 's4', 'q1', 'd', {}],
+    ['2017-05-23T12:35:42', 6, 'c2', 's2', 'q2', 2, {}],
+]
+
+EXPECTED = [
+    ['s1', 'c1', '2017-05-23T12:35:40', 'a', 1],
+    ['s2', 'c2', '2017-05-23T12:35:42', 'b', 2],
+    ['s3', 'c3', '2017-05-23T12:35:39', None, 3],
+    ['s4', 'c4', '2017-05-23T12:35:41', 'd', None],
+]
+
+
+def test_pivot_in_memory():
+    """
+    Test pivot_rows() without spilling uses the questions order.
+    """
+    pivot = SessionPivot(QUESTIONS)
+    assert pivot.columns == [
+        'session_id', 'contact_id', 'timestamp', 'q1', 'q2'
+    ]
+    assert sorted(pivot.pivot(ROWS)) == EXPECTED
+    assert pivot.spilled == 0
+
+
+def test_pivot_spills_out_of_order_rows(tmpdir):  # pylint: disable=C0103
+    """
+    Test SessionPivot spills sessions that leave the window and still emits
+    one record per session.
+    """
+    pivot = SessionPivot(QUESTIONS, window=1, tmpdir=str(tmpdir))
+    records = list(pivot.pivot(ROWS))
+
+    assert sorted(records) == EXPECTED
+    assert pivot.spilled > 0
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_pivot_ordered():
+    """
+    Test ordered pivots emit sessions as they leave the window.
+    """
+    rows = sorted(ROWS, key=lambda row: row[3])
+    records = pivot_rows(iter(rows), QUESTIONS, window=1, ordered=True)
+
+    assert next(records) == EXPECTED[0]
+    assert list(records) == EXPECTED[1:]
+
+
+def test_pivot_descriptor_questions():
+    """
+    Test SessionPivot takes the questions of a descriptor.
+    """
+    descriptor = load_descriptor('data/flow-results-example-1.json')
+    pivot = SessionPivot(descriptor)
+
+    assert pivot.columns[3:] == list(
+        descriptor['resources'][0]['schema']['questions'])
+
+
+def test_pivot_spilled_sessions_cache(tmpdir):  # pylint: disable=C0103
+    """
+    Test SessionPivot finds spilled sessions in the spill file once they leave
+    its bounded cache.
+    """
+    rows = [['2017-05-23T12:35:%02d' % (index % 60), index, 'c%d' % session,
+             's%03d' % session, question, index, {}]
+            for index, (question, session) in enumerate(
+                (question, session) for question in ('q1', 'q2')
+                for session in range(50))]
+    pivot = SessionPivot(QUESTIONS, window=2, tmpdir=str(tmpdir))
+    records = pivot.pivot(rows)
+    first = next(records)
+    # pylint: disable=protected-access
+    assert len(pivot._spill._cache) <= 2
+    records = sorted([first] + list(records))
+
+    assert len(records) == 50
+    assert records[0] == ['s000', 'c0', '2017-05-23T12:35:50', 0, 50]
+    assert records[-1] == ['s049', 'c49', '2017-05-23T12:35:49', 49, 99]
+    assert pivot.spilled >= 48
@@ -0,0 +1,170 @@
+# -*- coding=utf-8 -*-
+"""
+Test sharded conversion of Flow Results data.
+"""
+import json
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from floip.cli import cli
+from floip.data import read_data, write_data
+from floip.pivot import SessionPivot
+from floip.shard import ShardJob, iter_shard_rows, shard_ranges
+
+QUESTIONS = [{'q1': {'type': 'text'}}, {'q2': {'type': 'select_many'}}]
+
+ANSWERS = (('q1', u'tëxt'), ('q2', ['a', 'b']))
+
+
+def _rows(sessions, interleaved=False):
+    rows = []
+    answers = [(session, question, response) for session in range(sessions)
+               for question, response in ANSWERS]
+    if interleaved:
+        answers.sort(key=lambda answer: answer[1])
+    for session, question, response in answers:
+        rows.append([
+            '2017-05-23T12:35:%02d' % (session % 60), len(rows),
+            'c%d' % session, 's%d' % session, question, response, {}
+        ])
+
+    return rows
+
+
+def _descriptor(tmpdir, sessions=100, interleaved=False):
+    path = str(tmpdir.join('data.json'))
+    write_data(path, _rows(sessions, interleaved))
+
+    return {
+        'name': 'flow',
+        'resources': [{
+            'path': path,
+            'schema': {
+                'questions': QUESTIONS
+            }
+        }]
+    }
+
+
+def test_shard_ranges(tmpdir):
+    """
+    Test shard_ranges() covers the file and keeps sessions in one shard.
+    """
+    path = _descriptor(tmpdir)['resources'][0]['path']
+    ranges = shard_ranges(path, 7, sessions=True)
+
+    assert len(ranges) == 7
+    assert ranges[0][0] == 0 and ranges[-1][1] == os.path.getsize(path)
+    assert all(end == start for (_s, end), (start, _e) in
+               zip(ranges, ranges[1:]))
+    rows = []
+    sessions = set()
+    for start, end in ranges:
+        shard_sessions = set(row[3] for row in
+                             iter_shard_rows(path, start, end))
+        assert not shard_sessions & sessions
+        sessions |= shard_sessions
+        rows.extend(iter_shard_rows(path, start, end))
+    assert rows == list(read_data(path))
+    assert len(shard_ranges(path, 1000)) <= 201
+
+
+def test_shard_job(tmpdir):
+    """
+    Test ShardJob gives the records of an unsharded conversion and resumes
+    only the shards that are not done.
+    """
+    descriptor = _descriptor(tmpdir)
+    work_dir = str(tmpdir.join('work'))
+    job = ShardJob(descriptor, work_dir, shards=4)
+    result = job.run(workers=2)
+    assert sorted(index for index, _progress in result.converted) == \
+        [0, 1, 2, 3]
+    assert job.pending() == []
+
+    output = str(tmpdir.join('submissions.json'))
+    assert job.merge(output) == 100
+    with open(output) as output_file:
+        submissions = json.load(output_file)
+    assert submissions == list(SessionPivot(QUESTIONS).submissions(
+        read_data(descriptor['resources'][0]['path']), sort=True))
+    assert submissions[0]['q2'] == 'a b'
+
+    os.remove(job.progress_path(2))
+    job = ShardJob(descriptor, work_dir, shards=8)
+    assert len(job.shards) == 4
+    with pytest.raises(ValueError):
+        job.merge(output)
+    result = job.run(workers=1)
+    assert [index for index, _progress in result.converted] == [2]
+    assert job.merge(output) == 100
+
+    write_data(descriptor['resources'][0]['path'], _rows(10))
+    with pytest.raises(ValueError):
+        ShardJob(descriptor, work_dir)
+
+
+def test_shard_job_interleaved_sessions(tmpdir):  # pylint: disable=C0103
+    """
+    Test ShardJob merges the submissions of sessions spanning several shards.
+    """
+    descriptor = _descriptor(tmpdir, 20, interleaved=True)
+    job = ShardJob(descriptor, str(tmpdir.join('work')), shards=4)
+    assert not job.run(workers=1).failures
+
+    output = str(tmpdir.join('submissions.json'))
+    assert job.merge(output) == 20
+    with open(output) as output_file:
+        submissions = json.load(output_file)
+    assert submissions == list(SessionPivot(QUESTIONS).submissions(
+        read_data(descriptor['resources'][0]['path']), sort=True))
+    assert all(submission['q1'] == u'tëxt' and submission['q2'] == 'a b'
+               for submission in submissions)
+
+
+def test_shard_job_layout(tmpdir):
+    """
+    Test ShardJob rejects data files without one row per line.
+    """
+    descriptor = _descriptor(tmpdir, 10)
+    path = descriptor['resources'][0]['path']
+    rows = list(read_data(path))
+    for indent in (None, 2):
+        with open(path, 'w') as data_file:
+            json.dump(rows, data_file, indent=indent)
+        with pytest.raises(ValueError) as error:
+            ShardJob(descriptor, str(tmpdir.join('work-%s' % indent)))
+        assert 'does not have one row per line' in str(error.value)
+
+    with open(path, 'w') as data_file:
+        data_file.write('[\n["a", 1],\n]\n')
+    with pytest.raises(ValueError):
+        shard_ranges(path, 2)
+
+
+def test_submissions_command(tmpdir):
+    """
+    Test floip submissions converts and merges shards, reading the data
+    relative to the descriptor.
+    """
+    descriptor_path = str(tmpdir.join('flow.json'))
+    descriptor = _descriptor(tmpdir, 10)
+    descriptor['resources'][0]['path'] = 'data.json'
+    with open(descriptor_path, 'w') as descriptor_file:
+        json.dump(descriptor, descriptor_file)
+    output = str(tmpdir.join('submissions.json'))
+    result = CliRunner().invoke(cli, [
+        'submissions', descriptor_path, output, '--shards', '2', '-w', '1',
+        '--shard', '0'
+    ])
+    assert result.exit_code == 0
+    assert '1 shards converted, 0 failed, 1 pending' in result.output
+    assert not os.path.exists(output)
+
+    result = CliRunner().invoke(
+        cli, ['submissions', descriptor_path, output, '-w', '1'])
+    assert result.exit_code == 0
+    assert '10 submissions written' in result.output
+    assert os.path.exists(output)
@@ -0,0 +1,89 @@
+# -*- coding=utf-8 -*-
+"""
+Test bulk loading Flow Results data into SQLite.
+"""
+import json
+import sqlite3
+
+import pytest
+from click.testing import CliRunner
+
+from floip import ValidationError, load_descriptor
+from floip.cli import cli
+from floip.data import write_data
+from floip.sqlite import SQLiteLoader
+
+ROWS = [
+    ['2017-05-23T12:35:37', 1, 'c1', 's1', 'ae54d1', 'female', {}],
+    ['2017-05-23T12:35:38', 2, 'c1', 's1', 'ae54d2', ['chocolate'], {}],
+    ['2017-05-23T12:35:39', 3, 'c2', 's2', 'ae54d3', 160, {}],
+    ['2017-05-23T12:35:40', 4, 'c1', 's1', 'ae54d3', 150, {}],
+    ['2017-05-23T12:35:41', 5, 'c2', 's2', 'unknown', 'x', {}],
+    ['2017-05-23T12:35:42', 6, 'c2', 's2', 'ae54d1', 'male', {}],
+]
+
+
+def test_sqlite_loader():
+    """
+    Test SQLiteLoader.load() pivots rows into one record per session across
+    batches.
+    """
+    connection = sqlite3.connect(':memory:')
+    loader = SQLiteLoader(connection, 'data/flow-results-example-1.json',
+                          table='flow', batch_size=2)
+
+    assert loader.load(ROWS) == 5
+    assert loader.skipped == 1
+    assert loader.rows_per_second > 0
+    records = connection.execute(
+        'SELECT session_id, contact_id, timestamp, ae54d1, ae54d2, ae54d3 '
+        'FROM flow ORDER BY session_id').fetchall()
+    assert records == [
+        ('s1', 'c1', '2017-05-23T12:35:40', 'female', '["chocolate"]', 150),
+        ('s2', 'c2', '2017-05-23T12:35:42', 'male', None, 160),
+    ]
+    indexes = connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND "
+        "tbl_name = 'flow'").fetchall()
+    assert ('flow_contact_id', ) in indexes
+
+
+def test_sqlite_loader_column_clash():
+    """
+    Test SQLiteLoader rejects questions named like a session column or
+    another question, ignoring case.
+    """
+    for names in (['timestamp'], ['Timestamp'], ['q1', 'Q1']):
+        descriptor = load_descriptor('data/flow-results-example-1.json')
+        for name in names:
+            descriptor['resources'][0]['schema']['questions'][name] = {
+                'type': 'text',
+                'label': 'When?'
+            }
+        with pytest.raises(ValidationError):
+            SQLiteLoader(':memory:', descriptor)
+
+    descriptor['resources'][0]['schema']['questions'].pop('Q1')
+    SQLiteLoader(':memory:', descriptor).create_table()
+
+
+def test_sqlite_command(tmpdir):
+    """
+    Test the floip sqlite command loads a package's data resource relative to
+    the descriptor.
+    """
+    descriptor = load_descriptor('data/flow-results-example-1.json')
+    descriptor['resources'][0]['path'] = 'flow-data.json.gz'
+    descriptor_file = tmpdir.join('flow.json')
+    descriptor_file.write(json.dumps(descriptor))
+    write_data(str(tmpdir.join('flow-data.json.gz')), ROWS)
+    database = str(tmpdir.join('flow.db'))
+    result = CliRunner().invoke(
+        cli, ['sqlite', str(descriptor_file), database])
+
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith(
+        '5 rows loaded into flow-results-example-1')
+    connection = sqlite3.connect(database)
+    assert connection.execute(
+        'SELECT COUNT(*) FROM "flow-results-example-1"').fetchone() == (2, )
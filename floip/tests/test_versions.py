@@ -0,0 +1,138 @@
+# -*- coding=utf-8 -*-
+"""
+Test the descriptor version store.
+"""
+import copy
+import json
+
+import pytest
+
+from floip import ValidationError
+from floip.versions import (ResponseMapper, VersionStore, apply_diff,
+                            diff_questions)
+
+OLD = [
+    {'name': {'type': 'text', 'label': 'Name?'}},
+    {'age': {'type': 'numeric', 'label': 'Age?'}},
+    {'color': {'type': 'select_one', 'label': 'Color?',
+               'type_options': {'choices': ['red', 'blue', 'green']}}},
+    {'notes': {'type': 'open', 'label': 'Notes'}},
+]  # yapf: disable
+
+NEW = [
+    {'name': {'type': 'text', 'label': 'Full name?'}},
+    {'age': {'type': 'text', 'label': 'Age?'}},
+    {'color': {'type': 'select_many', 'label': 'Color?',
+               'type_options': {'choices': ['red', 'blue']}}},
+    {'phone': {'type': 'text', 'label': 'Phone?'}},
+]  # yapf: disable
+
+
+def test_diff_questions():
+    """
+    Test diff_questions() by question id and apply_diff().
+    """
+    diff = diff_questions(OLD, NEW)
+
+    assert diff == {
+        'added': {'phone': {'type': 'text', 'label': 'Phone?'}},
+        'removed': ['notes'],
+        'changed': {
+            'name': {'label': 'Full name?'},
+            'age': {'type': 'text'},
+            'color': {
+                'type': 'select_many',
+                'type_options': {'choices': ['red', 'blue']}
+            }
+        },
+        'removed_properties': {}
+    }  # yapf: disable
+    assert apply_diff(OLD, json.loads(json.dumps(diff))) == \
+        dict(list(question.items())[0] for question in NEW)
+
+
+def test_diff_removed_and_null_properties():  # pylint: disable=C0103
+    """
+    Test diff_questions() tells removed properties from properties set to
+    null, also after a JSON round trip.
+    """
+    old = [{'q1': {'type': 'text', 'label': 'Name?', 'hint': 'Full name'}}]
+    new = [{'q1': {'type': 'text', 'label': None}}]
+    diff = diff_questions(old, new)
+
+    assert diff['changed'] == {'q1': {'label': None}}
+    assert diff['removed_properties'] == {'q1': ['hint']}
+    assert apply_diff(old, json.loads(json.dumps(diff))) == {
+        'q1': {'type': 'text', 'label': None}
+    }
+
+
+def test_response_mapper():
+    """
+    Test ResponseMapper converts responses to the new types and drops rows it
+    can not map.
+    """
+    rows = [
+        ['2017-05-23T12:35:37', 1, 'c1', 's1', 'name', 'Jane', {}],
+        ['2017-05-23T12:35:37', 2, 'c1', 's1', 'age', 30, {}],
+        ['2017-05-23T12:35:37', 3, 'c1', 's1', 'color', 'red', {}],
+        ['2017-05-23T12:35:37', 4, 'c1', 's1', 'notes', 'Note', {}],
+        ['2017-05-23T12:35:38', 5, 'c2', 's2', 'color', 'green', {}],
+    ]
+    mapper = ResponseMapper(OLD, NEW)
+
+    assert list(mapper.map_rows(rows)) == [
+        ['2017-05-23T12:35:37', 1, 'c1', 's1', 'name', 'Jane', {}],
+        ['2017-05-23T12:35:37', 2, 'c1', 's1', 'age', u'30', {}],
+        ['2017-05-23T12:35:37', 3, 'c1', 's1', 'color', ['red'], {}],
+    ]
+    assert (mapper.mapped, mapper.dropped) == (3, 2)
+    assert ResponseMapper(NEW, OLD).map_row(
+        ['2017-05-23T12:35:37', 2, 'c1', 's1', 'age', '30.5', {}])[5] == 30.5
+
+
+def test_version_store(tmpdir):
+    """
+    Test VersionStore records versions by id and modified.
+    """
+    with open('data/flow-results-example-1.json') as descriptor_file:
+        descriptor = json.load(descriptor_file)
+    store = VersionStore(str(tmpdir.join('versions')))
+    assert store.add(descriptor) is True
+    assert store.add(descriptor) is False
+
+    newer = copy.deepcopy(descriptor)
+    newer['modified'] = '2017-07-01 00:00:00+00:00'
+    questions = newer['resources'][0]['schema']['questions']
+    questions['ae54d3']['type'] = 'text'
+    del questions['ae54d7']
+    assert store.add(newer) is True
+    assert store.versions(descriptor['id']) == [
+        descriptor['modified'], newer['modified']
+    ]
+    assert store.diff(descriptor['id'], descriptor['modified']) == {
+        'added': {},
+        'removed': ['ae54d7'],
+        'changed': {'ae54d3': {'type': 'text'}},
+        'removed_properties': {}
+    }
+
+    mapper = VersionStore(store.path).mapper(descriptor['id'],
+                                             descriptor['modified'])
+    rows = [
+        ['2017-05-23T12:35:37', 1, 'c1', 's1', 'ae54d3', 150, {}],
+        ['2017-05-23T12:35:37', 2, 'c1', 's1', 'ae54d7', 'Yes', {}],
+    ]
+    assert list(mapper.map_rows(rows)) == [
+        ['2017-05-23T12:35:37', 1, 'c1', 's1', 'ae54d3', u'150', {}]
+    ]
+
+    questions['ae54d3']['type'] = 'numeric'
+    with pytest.raises(ValidationError):
+        store.add(newer)
+
+    descriptor['id'] = '../' + descriptor['id']
+    with pytest.raises(ValidationError):
+        store.add(descriptor)
+    with pytest.raises(ValidationError):
+        store.versions('../../flow')
@@ -0,0 +1,177 @@
+# -*- coding=utf-8 -*-
+"""
+Test the streaming XForm XML reader.
+"""
+import io
+import json
+
+import pytest
+from pyxform.builder import create_survey_element_from_dict
+
+from floip import FloipSurvey, ValidationError, survey_questions
+from floip.xform import (read_xform, xform_to_floip_descriptor,
+                         xform_to_floip_package)
+
+
+def test_read_xform():
+    """
+    Test read_xform() reads the form details and questions of an XForm.
+    """
+    survey, questions = read_xform('data/flow-results-example-1.xml')
+    assert survey == {
+        'name': 'data',
+        'id_string': 'flow-results-example-1',
+        'title': 'A nice title'
+    }
+    with open('data/flow-results-example-1.json') as descriptor_file:
+        descriptor = json.load(descriptor_file)
+    assert dict(questions) == \
+        descriptor['resources'][0]['schema']['questions']
+
+
+def test_read_xform_matches_survey_questions():  # pylint: disable=C0103
+    """
+    Test read_xform() matches survey_questions() for groups, calculates,
+    itext labels, notes and triggers.
+    """
+    survey = create_survey_element_from_dict({
+        'name': 'data',
+        'type': 'survey',
+        'id_string': 'groups',
+        'title': 'Groups',
+        'children': [{
+            'name': 'gender',
+            'type': 'select one',
+            'label': {'English': 'Gender?', 'French': 'Sexe?'},
+            'children': [{
+                'name': 'male',
+                'label': {'English': 'Male', 'French': 'Homme'}
+            }, {
+                'name': 'female',
+                'label': {'English': 'Female', 'French': 'Femme'}
+            }]
+        }, {
+            'name': 'details',
+            'type': 'group',
+            'label': 'Details',
+            'children': [{
+                'name': 'age',
+                'type': 'integer',
+                'label': 'Age?',
+                'bind': {'constraint': '. >= 2 and . <= 99'}
+            }, {
+                'name': 'total',
+                'type': 'calculate',
+                'bind': {'calculate': '1 + 1'}
+            }]
+        }, {
+            'name': 'photo',
+            'type': 'image',
+            'label': 'A photo'
+        }, {
+            'name': 'intro',
+            'type': 'note',
+            'label': 'A note'
+        }, {
+            'name': 'ready',
+            'type': 'trigger',
+            'label': 'Ready?'
+        }]
+    })  # yapf: disable
+    # pylint: disable=protected-access
+    xml = io.BytesIO(survey._to_pretty_xml().encode('utf-8'))
+    expected = list(survey_questions(survey.to_json_dict()['children']))
+
+    assert read_xform(xml)[1] == expected
+
+
+def test_xform_to_floip_package():
+    """
+    Test xform_to_floip_package() generates the example descriptor.
+    """
+    with open('data/flow-results-example-1.json') as descriptor_file:
+        descriptor = json.load(descriptor_file)
+    package = xform_to_floip_package(
+        'data/flow-results-example-1.xml', descriptor['id'],
+        descriptor['created'], descriptor['modified'],
+        'data/flow-results-example-1-data.json')
+
+    assert package.descriptor == descriptor
+    assert package.valid is True
+
+
+def test_read_xform_languages():
+    """
+    Test a multi-language XForm gives per-language labels and the default
+    language as the schema language.
+    """
+    with open('data/flow-results-example-1.json') as descriptor_file:
+        descriptor = json.load(descriptor_file)
+    questions = descriptor['resources'][0]['schema']['questions']
+    questions['ae54d3']['label'] = {
+        'eng': 'How much do you weigh, in lbs?',
+        'swa': 'Una uzito gani, kwa pauni?'
+    }
+    descriptor['resources'][0]['schema']['language'] = 'swa'
+    xml = FloipSurvey(descriptor).xml(validate=False)
+    survey, read_questions = read_xform(io.BytesIO(xml.encode('utf-8')))
+
+    assert survey['default_language'] == 'swa'
+    assert dict(read_questions) == questions
+    descriptor = xform_to_floip_descriptor(
+        io.BytesIO(xml.encode('utf-8')), descriptor['id'],
+        descriptor['created'], descriptor['modified'])
+    assert descriptor['resources'][0]['schema']['language'] == 'swa'
+    assert descriptor['resources'][0]['schema']['questions'] == questions
+
+
+ITEMSET_XFORM = u"""<?xml version="1.0"?>
+<h:html xmlns="http://www.w3.org/2002/xforms"
+        xmlns:h="http://www.w3.org/1999/xhtml">
+  <h:head>
+    <h:title>Cities</h:title>
+    <model>
+      <instance>
+        <data id="cities"><city/></data>
+      </instance>
+      <instance id="cities">
+        <root>
+          <item><name>nairobi</name><label>Nairobi</label></item>
+          <item><name>kampala</name><label>Kampala</label></item>
+        </root>
+      </instance>
+      <instance id="towns" src="jr://file-csv/towns.csv"/>
+      <bind nodeset="/data/city" type="select1"/>
+    </model>
+  </h:head>
+  <h:body>
+    <select1 ref="/data/city">
+      <label>City?</label>
+      <itemset nodeset="%s">
+        <value ref="name"/>
+        <label ref="label"/>
+      </itemset>
+    </select1>
+  </h:body>
+</h:html>
+"""
+
+
+def test_read_xform_itemsets():
+    """
+    Test read_xform() reads the choices of itemsets from secondary instances
+    and raises a ValidationError for instances not in the form.
+    """
+    xml = ITEMSET_XFORM % "instance('cities')/root/item[name != '']"
+    survey, questions = read_xform(io.BytesIO(xml.encode('utf-8')))
+
+    assert survey['id_string'] == 'cities'
+    assert questions == [('city', {
+        'type': 'select_one',
+        'label': 'City?',
+        'type_options': {'choices': ['nairobi', 'kampala']}
+    })]
+    for nodeset in ("instance('towns')/root/item", "/data/city"):
+        xml = ITEMSET_XFORM % nodeset
+        with pytest.raises(ValidationError):
+            read_xform(io.BytesIO(xml.encode('utf-8')))
@@ -0,0 +1,43 @@
+# -*- coding=utf-8 -*-
+"""
+File and time helpers shared by the FLOIP modules.
+"""
+import codecs
+import errno
+import json
+import os
+import time
+
+# Format of the descriptor ``created`` and ``modified`` fields.
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S+00:00'
+
+
+def utc_timestamp():
+    """
+    Returns the current time formatted as the descriptor ``modified`` field.
+    """
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime())
+
+
+def makedirs(path):
+    """
+    Creates a directory and its parents unless it exists.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+
+
+def write_json(path, content):
+    """
+    Writes JSON content to a temporary file and renames it to ``path``, so
+    that ``path`` is always either the old or the new content.
+    """
+    tmp_path = path + '.tmp'
+    with codecs.open(tmp_path, 'w', encoding='utf-8') as tmp_file:
+        json.dump(content, tmp_file, indent=2, sort_keys=True)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    getattr(os, 'replace', os.rename)(tmp_path, path)
@@ -0,0 +1,263 @@
+# -*- coding=utf-8 -*-
+"""
+Descriptor version store, diffs of question schemas and mapping of responses
+of older versions onto the latest schema.
+"""
+import codecs
+import json
+import os
+import uuid
+from collections import OrderedDict
+
+import six
+
+from floip import ValidationError, load_descriptor, question_items
+from floip.utils import makedirs, write_json
+
+
+def _numeric(response):
+    number = float(response)
+    return int(number) if number.is_integer() else number
+
+
+def _select_one(response):
+    if len(response) != 1:
+        raise ValueError('Expecting one choice, got %d' % len(response))
+    return response[0]
+
+
+# Response conversions of question type changes, ``None`` keeps the response.
+CONVERSIONS = {
+    ('select_one', 'select_many'): lambda response: [response],
+    ('select_many', 'select_one'): _select_one,
+    ('numeric', 'text'): six.text_type,
+    ('numeric', 'open'): six.text_type,
+    ('text', 'numeric'): _numeric,
+    ('open', 'numeric'): _numeric,
+    ('text', 'open'): None,
+    ('open', 'text'): None,
+}
+
+
+def diff_questions(old, new):
+    """
+    Returns the diff of two ``questions`` objects or arrays by question id: the
+    ``added`` questions, the ids of the ``removed`` questions, for each
+    ``changed`` question its properties that were added or changed with their
+    new value and, in ``removed_properties``, the properties each question no
+    longer has.
+    """
+    old = OrderedDict(question_items(old))
+    new = OrderedDict(question_items(new))
+    changed = OrderedDict()
+    removed_properties = OrderedDict()
+    for name, question in new.items():
+        if name not in old or old[name] == question:
+            continue
+        changes = {
+            key: value
+            for key, value in question.items()
+            if key not in old[name] or old[name][key] != value
+        }
+        if changes:
+            changed[name] = changes
+        removed = sorted(key for key in old[name] if key not in question)
+        if removed:
+            removed_properties[name] = removed
+
+    return {
+        'added': OrderedDict(
+            (name, question) for name, question in new.items()
+            if name not in old),
+        'removed': [name for name in old if name not in new],
+        'changed': changed,
+        'removed_properties': removed_properties
+    }
+
+
+def apply_diff(questions, diff):
+    """
+    Returns the ``questions`` object of a ``questions`` object or array with a
+    diff of ``diff_questions`` applied.
+    """
+    questions = OrderedDict(
+        (name, dict(question)) for name, question in question_items(questions)
+        if name not in diff['removed'])
+    for name, changes in diff['changed'].items():
+        questions[name].update(changes)
+    for name, keys in diff.get('removed_properties', {}).items():
+        for key in keys:
+            questions[name].pop(key, None)
+    questions.update(diff['added'])
+
+    return questions
+
+
+class ResponseMapper(object):
+    """
+    Maps Flow Results rows of one questions schema onto another in a single
+    streaming pass.
+
+    Rows of questions removed from the new schema, and responses that can not
+    be converted to a question's new type or are not one of its new choices,
+    are dropped and counted in ``dropped``.
+    """
+
+    def __init__(self, old, new):
+        self.diff = diff_questions(old, new)
+        self.mapped = 0
+        self.dropped = 0
+        old = dict(question_items(old))
+        new = dict(question_items(new))
+        # question id to a conversion function, ``None`` keeps the response.
+        self._converters = {}
+        for name, question in old.items():
+            if name not in new:
+                continue
+            converter = None
+            old_type, new_type = question['type'], new[name]['type']
+            if old_type != new_type:
+                if (old_type, new_type) not in CONVERSIONS:
+                    continue
+                converter = CONVERSIONS[(old_type, new_type)]
+            choices = (new[name].get('type_options') or {}).get('choices')
+            if choices is not None and \
+                    choices != (question.get('type_options') or {}).get(
+                        'choices'):
+                converter = self._choices_converter(
+                    converter, set(choices), new_type == 'select_many')
+            self._converters[name] = converter
+
+    @staticmethod
+    def _choices_converter(converter, choices, many):
+        def _convert(response):
+            if converter is not None:
+                response = converter(response)
+            if not set(response if many else [response]) <= choices:
+                raise ValueError('Response is not one of the choices')
+            return response
+
+        return _convert
+
+    def map_row(self, row):
+        """
+        Returns a row mapped onto the new schema, ``None`` when it is dropped.
+        """
+        question_id = row[4]
+        if question_id not in self._converters:
+            self.dropped += 1
+            return None
+        converter = self._converters[question_id]
+        if converter is not None:
+            try:
+                row = list(row[:5]) + [converter(row[5])] + list(row[6:])
+            except (TypeError, ValueError):
+                self.dropped += 1
+                return None
+        self.mapped += 1
+
+        return row
+
+    def map_rows(self, rows):
+        """
+        Returns an iterator of rows mapped onto the new schema.
+        """
+        for row in rows:
+            row = self.map_row(row)
+            if row is not None:
+                yield row
+
+
+class VersionStore(object):
+    """
+    Stores the ``questions`` snapshot of each version of a flow's descriptor,
+    keyed by the descriptor ``id`` and ``modified`` fields, in a
+    ``<id>.json`` file per flow in the ``path`` directory. Flow ids must be
+    UUIDs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        makedirs(path)
+
+    def _flow_path(self, flow_id):
+        try:
+            flow_id = uuid.UUID(flow_id)
+        except (AttributeError, TypeError, ValueError):
+            raise ValidationError('Flow ID %r is not a UUID' % (flow_id, ))
+        return os.path.join(self.path, '%s.json' % flow_id)
+
+    def _load(self, flow_id):
+        path = self._flow_path(flow_id)
+        if not os.path.exists(path):
+            return {'id': flow_id, 'versions': []}
+        with codecs.open(path, encoding='utf-8') as flow_file:
+            return json.load(flow_file, object_pairs_hook=OrderedDict)
+
+    def add(self, descriptor):
+        """
+        Records the questions of a FLOIP descriptor, returns ``True`` when it
+        is a new version. A version is identified by its ``modified`` field
+        and can not change once recorded.
+        """
+        descriptor = getattr(descriptor, 'descriptor', None) or \
+            load_descriptor(descriptor)
+        flow = self._load(descriptor['id'])
+        questions = [{
+            name: question
+        } for name, question in question_items(
+            descriptor['resources'][0]['schema']['questions'])]
+        for version in flow['versions']:
+            if version['modified'] == descriptor['modified']:
+                if version['questions'] != questions:
+                    raise ValidationError(
+                        'Version %s of flow %s has different questions.' %
+                        (descriptor['modified'], descriptor['id']))
+                return False
+        flow['versions'].append({
+            'modified': descriptor['modified'],
+            'questions': questions
+        })
+        flow['versions'].sort(key=lambda version: version['modified'])
+        write_json(self._flow_path(descriptor['id']), flow)
+
+        return True
+
+    def versions(self, flow_id):
+        """
+        Returns the ``modified`` fields of the versions of a flow, oldest
+        first.
+        """
+        return [version['modified'] for version in
+                self._load(flow_id)['versions']]
+
+    def questions(self, flow_id, modified=None):
+        """
+        Returns the ``questions`` array of a version of a flow, the latest
+        version by default.
+        """
+        versions = self._load(flow_id)['versions']
+        if not versions:
+            raise KeyError(flow_id)
+        if modified is None:
+            return versions[-1]['questions']
+        for version in versions:
+            if version['modified'] == modified:
+                return version['questions']
+        raise KeyError(modified)
+
+    def diff(self, flow_id, old, new=None):
+        """
+        Returns the ``diff_questions`` of two versions of a flow, from ``old``
+        to the latest version by default.
+        """
+        return diff_questions(self.questions(flow_id, old),
+                              self.questions(flow_id, new))
+
+    def mapper(self, flow_id, modified):
+        """
+        Returns a ``ResponseMapper`` of the rows of a version of a flow onto
+        its latest version.
+        """
+        return ResponseMapper(self.questions(flow_id, modified),
+                              self.questions(flow_id))
@@ -0,0 +1,306 @@
+# -*- coding=utf-8 -*-
+"""
+Streaming XForm XML reader that generates FLOIP questions without building a
+pyxform survey.
+"""
+import re
+import xml.etree.ElementTree as ETree
+from collections import OrderedDict
+
+from datapackage import Package
+from pyxform import constants
+
+from floip import (ITEXT_REF_REGEX, ValidationError,
+                   floip_dict_from_xform_dict, survey_to_floip_descriptor)
+
+# XForm bind types to pyxform question types.
+BIND_TYPES = {
+    'date': 'date',
+    'dateTime': 'dateTime',
+    'geopoint': 'geopoint',
+    'int': 'integer',
+    'select': constants.SELECT_ALL_THAT_APPLY,
+    'select1': constants.SELECT_ONE,
+    'string': 'text',
+    'time': 'time'
+}
+
+MEDIA_TYPES = {'image/*': 'image', 'audio/*': 'audio', 'video/*': 'video'}
+
+# Body controls to their implied bind type when a control has no bind.
+CONTROLS = {
+    'input': 'string',
+    'select': 'select',
+    'select1': 'select1',
+    'upload': 'binary'
+}
+
+GROUPS = ('group', 'repeat')
+
+# the instance of an itemset nodeset, e.g. instance('cities')/root/item.
+ITEMSET_REGEX = re.compile(r"""\s*instance\(\s*['"]([^'"]*)['"]\s*\)""")
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def _text(elem):
+    return ''.join(elem.itertext()).strip()
+
+
+def _resolve(ref, parents):
+    if ref.startswith('/') or not parents:
+        return ref
+    return '/'.join([parents[-1], ref])
+
+
+def _xform_question(bind, control, label):
+    bind_type = bind.get('type') or CONTROLS.get(control.get('tag'), 'string')
+    bind_type = bind_type.rpartition(':')[2]
+    if bind.get('calculate') is not None and not control:
+        question_type = 'calculate'
+    elif not control:
+        return None
+    elif bind.get('readonly') == 'true()' and bind.get('calculate') is None:
+        # notes are read only inputs, they do not have responses.
+        return None
+    elif bind_type == 'binary':
+        question_type = MEDIA_TYPES.get(control.get('mediatype'))
+    else:
+        question_type = BIND_TYPES.get(bind_type)
+    if question_type is None:
+        return None
+
+    question = {
+        'type': question_type,
+        'bind': {
+            key: bind[key]
+            for key in ('constraint', 'calculate') if key in bind
+        },
+        'children': [
+            {'name': choice} for choice in control.get('choices', [])
+        ]
+    }
+    if label:
+        question['label'] = label
+
+    return question
+
+
+def _itext_label(translations, default_language, text_id):
+    if len(translations) == 1:
+        return translations[default_language].get(text_id)
+    labels = {
+        language: texts[text_id]
+        for language, texts in translations.items() if text_id in texts
+    }
+
+    return labels or None
+
+
+def _read_control(elem, tag):
+    control = {'tag': tag, 'mediatype': elem.get('mediatype'), 'choices': []}
+    for child in elem:
+        child_tag = _local_name(child.tag)
+        if child_tag == 'label':
+            match = ITEXT_REF_REGEX.match(child.get('ref') or '')
+            control['label'] = match.group(1) if match else _text(child)
+            control['itext'] = bool(match)
+        elif child_tag == 'item':
+            control['choices'].extend(
+                _text(value) for value in child
+                if _local_name(value.tag) == 'value')
+        elif child_tag == 'itemset':
+            control['itemset'] = (child.get('nodeset') or '', [
+                value.get('ref') for value in child
+                if _local_name(value.tag) == 'value'
+            ])
+
+    return control
+
+
+class _XFormReader(object):
+    """
+    ``iterparse`` event handlers of ``read_xform``. Elements are discarded as
+    soon as they are read, only the binds, labels, choices and the items of
+    secondary instances are kept.
+    """
+
+    def __init__(self):
+        self.survey = {'name': None, 'id_string': None, 'title': None}
+        self.binds = OrderedDict()
+        self.controls = OrderedDict()
+        # (language, {text id: text}) pairs of the itext translations.
+        self.translations = []
+        self.parents = []
+        # secondary instance id to the list of its items, ``None`` for
+        # external instances.
+        self.instances = {}
+        # the depth, whether it is the main instance and the items of the
+        # instance being read.
+        self._instance = None
+
+    def read(self, source):
+        """
+        Reads an XForm XML file path or file object.
+        """
+        for event, elem in ETree.iterparse(source, events=('start', 'end')):
+            tag = _local_name(elem.tag)
+            if self._instance is not None:
+                self._instance_event(event, elem, tag)
+            elif event == 'start':
+                self._start(elem, tag)
+            else:
+                self._end(elem, tag)
+        if self.translations and 'default_language' not in self.survey:
+            self.survey['default_language'] = self.translations[0][0]
+
+    def _instance_event(self, event, elem, tag):
+        instance = self._instance
+        instance['depth'] += 1 if event == 'start' else -1
+        if instance['depth'] == 2:
+            if instance['main'] and event == 'start' and \
+                    self.survey['name'] is None:
+                self.survey['name'] = tag
+                self.survey['id_string'] = elem.get('id')
+            elif instance['items'] is not None and event == 'end':
+                instance['items'].append({
+                    _local_name(child.tag): _text(child) for child in elem
+                })
+                elem.clear()
+        if instance['depth'] == 0:
+            self._instance = None
+            elem.clear()
+
+    def _start(self, elem, tag):
+        if tag == 'instance':
+            instance_id = elem.get('id')
+            items = None
+            if instance_id is not None:
+                if elem.get('src') is None:
+                    items = []
+                self.instances[instance_id] = items
+            self._instance = {
+                'depth': 1,
+                'main': instance_id is None,
+                'items': items
+            }
+        elif tag == 'translation':
+            self.translations.append((elem.get('lang'), {}))
+            if elem.get('default') is not None:
+                self.survey['default_language'] = elem.get('lang')
+        elif tag in GROUPS:
+            self.parents.append(
+                _resolve(elem.get('ref') or elem.get('nodeset') or '',
+                         self.parents))
+
+    def _end(self, elem, tag):
+        if tag == 'title':
+            self.survey['title'] = _text(elem)
+        elif tag == 'text' and self.translations:
+            texts = self.translations[-1][1]
+            for value in elem:
+                if _local_name(value.tag) == 'value' and not value.get('form'):
+                    texts[elem.get('id')] = _text(value)
+            elem.clear()
+        elif tag == 'bind':
+            self.binds[elem.get('nodeset')] = dict(elem.attrib)
+            elem.clear()
+        elif tag in CONTROLS and elem.get('ref'):
+            self.controls[_resolve(elem.get('ref'), self.parents)] = \
+                _read_control(elem, tag)
+            elem.clear()
+        elif tag in GROUPS:
+            self.parents.pop()
+            elem.clear()
+        elif tag in ('itext', 'model', 'body'):
+            elem.clear()
+
+    def _itemset_choices(self, name, nodeset, value_refs):
+        """
+        Returns the choices of an itemset, the values of all the items of its
+        secondary instance.
+        """
+        match = ITEMSET_REGEX.match(nodeset)
+        items = self.instances.get(match.group(1)) if match else None
+        if items is None or len(value_refs) != 1:
+            raise ValidationError(
+                'Can not read the choices of %s from itemset %s' %
+                (name, nodeset))
+
+        return [item[value_refs[0]] for item in items
+                if value_refs[0] in item]
+
+    def questions(self):
+        """
+        Returns the list of (name, floip question) pairs of the form in bind
+        order.
+        """
+        translations = OrderedDict(self.translations)
+        default_language = self.survey.get('default_language')
+        prefix = '/%s/' % self.survey['name']
+        nodesets = list(self.binds) + [
+            ref for ref in self.controls if ref not in self.binds
+        ]
+        questions = []
+        for nodeset in nodesets:
+            name = nodeset[len(prefix):] if nodeset.startswith(prefix) \
+                else nodeset.lstrip('/')
+            if 'meta' in name.split('/')[:-1]:
+                continue
+            control = self.controls.get(nodeset, {})
+            if 'itemset' in control:
+                control['choices'] = self._itemset_choices(
+                    name, *control['itemset'])
+            label = control.get('label')
+            if control.get('itext'):
+                label = _itext_label(translations, default_language, label)
+            question = _xform_question(self.binds.get(nodeset, {}), control,
+                                       label)
+            if question is not None:
+                questions.append((name, floip_dict_from_xform_dict(question)))
+
+        return questions
+
+
+def read_xform(source):
+    """
+    Reads an XForm XML file path or file object with ``iterparse``, returning
+    a ``(survey, questions)`` pair where ``survey`` has the ``name``,
+    ``id_string`` and ``title`` of the form, and its ``default_language``
+    when it has itext translations, and ``questions`` is a list of (name,
+    floip question) pairs in bind order. Itext labels of forms with more than
+    one language are objects of label per language.
+
+    The choices of a select with an itemset are the values of all the items
+    of its secondary instance, a ``ValidationError`` is raised when the
+    instance is not in the form.
+
+    Elements are discarded as soon as they are read, only the binds, labels
+    and choices are kept in memory.
+    """
+    reader = _XFormReader()
+    reader.read(source)
+
+    return reader.survey, reader.questions()
+
+
+def xform_to_floip_descriptor(source, flow_id, created, modified, data=None):
+    """
+    Generates the Floip Descriptor dictionary of an XForm XML file path or
+    file object, the schema ``language`` is the form's default language.
+    """
+    survey, questions = read_xform(source)
+
+    return survey_to_floip_descriptor(
+        survey, flow_id, created, modified, data, questions=questions)
+
+
+def xform_to_floip_package(source, flow_id, created, modified, data=None):
+    """
+    Generates the Floip Descriptor package of an XForm XML file path or file
+    object.
+    """
+    return Package(
+        xform_to_floip_descriptor(source, flow_id, created, modified, data))